@@ -7,15 +7,25 @@ Handles user interactions, conversations, and command processing.
 """
 
 import asyncio
-import pytz
+import functools
 import logging
-from datetime import datetime, timedelta
+import time
+import weakref
+from datetime import date, datetime
+from dataclasses import dataclass
 from typing import Dict, Any, Optional
+from zoneinfo import ZoneInfoNotFoundError
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, PicklePersistence, PersistenceInput
 
-from config import *
+from config import (
+    BOT_NAME, WELCOME_MESSAGE, HELP_MESSAGE, SETUP_MESSAGE, TIMEZONE_MESSAGE,
+    ERROR_MESSAGES, SUCCESS_MESSAGES, DEFAULT_CALL_SETTINGS,
+    MAX_CALLS_PER_USER, MAX_MESSAGE_LENGTH, VALID_WEEKDAYS, VALID_WEEKDAY_SET, SYSTEM_TIMEZONE,
+    CONVERSATION_STATE_FILE, CONVERSATION_STATE_TTL, CONVERSATION_STATE_SWEEP_INTERVAL,
+    get_timezone, normalize_time_format, validate_message, validate_time_format
+)
 from storage import StorageManager
 from call_scheduler import CallScheduler
 from callmebot_api import CallMeBotAPI
@@ -27,13 +37,127 @@ logger = logging.getLogger(__name__)
 (WAITING_FOR_TIME, WAITING_FOR_MESSAGE, WAITING_FOR_SCHEDULE_TYPE, 
  WAITING_FOR_WEEKDAY, WAITING_FOR_USERNAME, WAITING_FOR_DELETE_CHOICE) = range(6)
 
+@dataclass(slots=True)
+class UserState:
+    """Conversation state for a user in the middle of a multi-step flow"""
+    action: str  # 'schedule', 'test_call' or 'settings'
+    step: str
+    type: Optional[str] = None  # Schedule type for 'schedule'
+    field: Optional[str] = None  # Setting being edited for 'settings'
+    date: Optional[str] = None
+    time: Optional[str] = None
+    message: Optional[str] = None
+    weekday: Optional[str] = None
+    expires_at: float = 0.0
+
+# Schedule type for each schedule keyboard button
+SCHEDULE_TYPE_CALLBACKS = {
+    "schedule_once": "once",
+    "schedule_daily": "daily",
+    "schedule_weekly": "weekly"
+}
+
+# Static inline keyboards (built once, reused on every request)
+START_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📞 Schedule Call", callback_data="schedule_start")],
+    [InlineKeyboardButton("🔧 Setup CallMeBot", callback_data="setup_start")],
+    [InlineKeyboardButton("📋 View Calls", callback_data="list_calls")],
+    [InlineKeyboardButton("🧪 Test Call", callback_data="test_call")]
+])
+
+SETUP_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ I've completed setup", callback_data="setup_complete")],
+    [InlineKeyboardButton("❓ I need help", callback_data="setup_help")]
+])
+
+SCHEDULE_TYPE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📞 One-time call", callback_data="schedule_once")],
+    [InlineKeyboardButton("🔄 Daily calls", callback_data="schedule_daily")],
+    [InlineKeyboardButton("📅 Weekly calls", callback_data="schedule_weekly")]
+])
+
+WEEKDAY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(day.title(), callback_data=f"weekday_{day}")]
+    for day in VALID_WEEKDAYS
+])
+
+LIST_CALLS_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🗑 Delete a call", callback_data="delete_call_menu")],
+    [InlineKeyboardButton("⏸ Pause/Resume calls", callback_data="toggle_calls_menu")]
+])
+
+SETTINGS_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👤 Set Username", callback_data="settings_username")],
+    [InlineKeyboardButton("📱 Set Phone", callback_data="settings_phone")],
+    [InlineKeyboardButton("🗣 Set Language", callback_data="settings_language")],
+    [InlineKeyboardButton("🔁 Set Repeat", callback_data="settings_repeat")]
+])
+
+TIMEZONE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Use Auto-Detected", callback_data="tz_auto")],
+    [InlineKeyboardButton("⚙️ Manual Setup", callback_data="tz_manual")]
+])
+
+def preview_message(message: str, limit: int = 50) -> str:
+    """Shorten a call message for display, adding '...' only if it was cut"""
+    if len(message) <= limit:
+        return message
+    return message[:limit] + "..."
+
+def serialized_per_user(handler):
+    """
+    Run a handler while holding its user's lock
+    
+    Updates are processed concurrently, but a user's conversation state
+    must only be advanced by one of their updates at a time.
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None:
+            return await handler(self, update, context)
+        
+        lock = self._user_locks.get(user.id)
+        if lock is None:
+            lock = self._user_locks[user.id] = asyncio.Lock()
+        async with lock:
+            return await handler(self, update, context)
+    return wrapper
+
 class CallSchedulerBot:
     """Main bot class that handles all Telegram interactions"""
     
-    def __init__(self, bot_token: str):
-        """Initialize the call scheduler bot"""
+    def __init__(self, bot_token: str, health_port: Optional[int] = None):
+        """Initialize the call scheduler bot
+        
+        If health_port is given, a /health endpoint is served on it from the
+        bot's event loop.
+        """
         self.bot_token = bot_token
-        self.application = Application.builder().token(bot_token).build()
+        self.health_port = health_port
+        self._health_server: Optional[asyncio.AbstractServer] = None
+        self._state_sweep_task: Optional[asyncio.Task] = None
+        
+        # Per-user locks for @serialized_per_user, dropped once no update holds them
+        self._user_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+        
+        # Persist per-user conversation state so it survives restarts
+        persistence = PicklePersistence(
+            filepath=CONVERSATION_STATE_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False)
+        )
+        # Process updates from different users concurrently so a slow CallMeBot
+        # request for one user doesn't hold up replies to everyone else;
+        # handlers that touch conversation state are serialized per user
+        self.application = (
+            Application.builder()
+            .token(bot_token)
+            .persistence(persistence)
+            .concurrent_updates(True)
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .build()
+        )
         
         # Initialize components in the correct order
         self.storage = StorageManager()
@@ -43,14 +167,74 @@ class CallSchedulerBot:
         # Link callmebot to scheduler (for dependency injection)
         self.scheduler.set_callmebot_api(self.callmebot)
         
-        # Track user conversation states
-        self.user_states: Dict[int, Dict[str, Any]] = {}
+        # Inline button routes, keyed by exact callback data or "prefix_"
+        self._callback_routes = {
+            "schedule_": self.handle_schedule_callback,
+            "weekday_": self.handle_weekday_callback,
+            "setup_": self.handle_setup_callback,
+            "delete_": self.handle_delete_callback,
+            "settings_": self.handle_settings_callback,
+            "tz_": self.handle_timezone_callback,
+            "list_calls": self.list_calls_from_callback,
+            "test_call": self.test_call_from_callback
+        }
         
         # Setup handlers
         self.setup_handlers()
         
         logger.info("CallSchedulerBot initialized successfully")
     
+    def _get_user_state(self, context: ContextTypes.DEFAULT_TYPE) -> Optional[UserState]:
+        """Get the user's conversation state, dropping it if it has gone idle"""
+        user_state = context.user_data.get('state')
+        if user_state is None:
+            return None
+        
+        now = time.time()
+        if user_state.expires_at < now:
+            del context.user_data['state']
+            return None
+        
+        # Sliding expiry - every interaction keeps the conversation alive
+        user_state.expires_at = now + CONVERSATION_STATE_TTL
+        return user_state
+    
+    def _set_user_state(self, context: ContextTypes.DEFAULT_TYPE, state: UserState):
+        """Start a new conversation state for the user"""
+        state.expires_at = time.time() + CONVERSATION_STATE_TTL
+        context.user_data['state'] = state
+    
+    def _clear_user_state(self, context: ContextTypes.DEFAULT_TYPE):
+        """Clear the user's conversation state"""
+        context.user_data.pop('state', None)
+    
+    def _purge_expired_states(self):
+        """Drop conversation states that went idle without the user coming back"""
+        now = time.time()
+        expired_users = [
+            user_id for user_id, data in self.application.user_data.items()
+            if 'state' in data and data['state'].expires_at < now
+        ]
+        for user_id in expired_users:
+            data = self.application.user_data[user_id]
+            del data['state']
+            if data:
+                self.application.mark_data_for_update_persistence(user_ids=user_id)
+            else:
+                self.application.drop_user_data(user_id)
+        
+        if expired_users:
+            logger.info("Discarded %d idle conversation(s)", len(expired_users))
+    
+    async def _sweep_user_states(self):
+        """Periodically purge idle conversations from user_data and its persistence file"""
+        while True:
+            try:
+                self._purge_expired_states()
+            except Exception:
+                logger.exception("Error sweeping idle conversation states")
+            await asyncio.sleep(CONVERSATION_STATE_SWEEP_INTERVAL)
+    
     def setup_handlers(self):
         """Setup all bot command and message handlers"""
         
@@ -92,22 +276,13 @@ class CallSchedulerBot:
         
         welcome_text = WELCOME_MESSAGE.format(bot_name=BOT_NAME)
         
-        # Create welcome keyboard
-        keyboard = [
-            [InlineKeyboardButton("📞 Schedule Call", callback_data="schedule_start")],
-            [InlineKeyboardButton("🔧 Setup CallMeBot", callback_data="setup_start")],
-            [InlineKeyboardButton("📋 View Calls", callback_data="list_calls")],
-            [InlineKeyboardButton("🧪 Test Call", callback_data="test_call")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             welcome_text,
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=START_KEYBOARD
         )
         
-        logger.info(f"User {user_id} ({user_name}) started the bot")
+        logger.info("User %s (%s) started the bot", user_id, user_name)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
@@ -115,16 +290,10 @@ class CallSchedulerBot:
     
     async def setup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /setup command"""
-        keyboard = [
-            [InlineKeyboardButton("✅ I've completed setup", callback_data="setup_complete")],
-            [InlineKeyboardButton("❓ I need help", callback_data="setup_help")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             SETUP_MESSAGE,
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=SETUP_KEYBOARD
         )
     
     async def schedule_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -137,17 +306,10 @@ class CallSchedulerBot:
             await update.message.reply_text(ERROR_MESSAGES["max_calls_reached"])
             return
         
-        keyboard = [
-            [InlineKeyboardButton("📞 One-time call", callback_data="schedule_once")],
-            [InlineKeyboardButton("🔄 Daily calls", callback_data="schedule_daily")],
-            [InlineKeyboardButton("📅 Weekly calls", callback_data="schedule_weekly")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             "📞 **What type of call would you like to schedule?**",
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=SCHEDULE_TYPE_KEYBOARD
         )
     
     async def list_calls_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -159,41 +321,39 @@ class CallSchedulerBot:
             await update.message.reply_text("📭 You have no scheduled calls.")
             return
         
-        calls_text = "📋 **Your Scheduled Calls:**\n\n"
+        parts = ["📋 **Your Scheduled Calls:**\n\n"]
         
         for call_id, call_info in user_calls.items():
             status_emoji = "✅" if call_info.get('active', True) else "⏸"
-            calls_text += f"{status_emoji} **{call_id}**\n"
-            calls_text += f"   ⏰ Time: {call_info['time']}\n"
-            calls_text += f"   📝 Message: {call_info['message'][:50]}{'...' if len(call_info['message']) > 50 else ''}\n"
-            calls_text += f"   🔄 Type: {call_info['type'].title()}\n"
+            parts.append(
+                f"{status_emoji} **{call_id}**\n"
+                f"   ⏰ Time: {call_info['time']}\n"
+                f"   📝 Message: {preview_message(call_info['message'])}\n"
+                f"   🔄 Type: {call_info['type'].title()}\n"
+            )
             if call_info['type'] == 'weekly':
-                calls_text += f"   📅 Day: {call_info.get('weekday', 'Unknown').title()}\n"
-            calls_text += "\n"
+                parts.append(f"   📅 Day: {call_info.get('weekday', 'Unknown').title()}\n")
+            parts.append("\n")
         
-        keyboard = [
-            [InlineKeyboardButton("🗑 Delete a call", callback_data="delete_call_menu")],
-            [InlineKeyboardButton("⏸ Pause/Resume calls", callback_data="toggle_calls_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        calls_text = "".join(parts)
         
         await update.message.reply_text(
             calls_text,
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=LIST_CALLS_KEYBOARD
         )
     
     async def delete_call_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /delete command"""
         await self.show_delete_menu(update, context)
     
+    @serialized_per_user
     async def test_call_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /test command"""
         user_id = update.effective_user.id
-        user_settings = self.storage.get_user_settings(user_id)
         
         # Check if user has configured their username/phone
-        if not user_settings.get('username') and not user_settings.get('phone'):
+        if self.storage.get_call_target(user_id) is None:
             await update.message.reply_text(
                 "❌ Please configure your username or phone number first.\n"
                 "Use /settings to set up your contact details."
@@ -201,10 +361,10 @@ class CallSchedulerBot:
             return
         
         # Set user state for test call
-        self.user_states[user_id] = {
-            'action': 'test_call',
-            'step': 'waiting_for_message'
-        }
+        self._set_user_state(context, UserState(
+            action='test_call',
+            step='waiting_for_message'
+        ))
         
         await update.message.reply_text(
             "🧪 **Test Call Setup**\n\n"
@@ -218,27 +378,22 @@ class CallSchedulerBot:
         user_id = update.effective_user.id
         user_settings = self.storage.get_user_settings(user_id)
         
-        settings_text = "⚙️ **Your Settings:**\n\n"
-        settings_text += f"👤 Username: {user_settings.get('username', 'Not set')}\n"
-        settings_text += f"📱 Phone: {user_settings.get('phone', 'Not set')}\n"
-        settings_text += f"🗣 Language: {user_settings.get('language', DEFAULT_CALL_SETTINGS['language'])}\n"
-        settings_text += f"🔁 Repeat: {user_settings.get('repeat', DEFAULT_CALL_SETTINGS['repeat'])} times\n"
-        settings_text += f"⏱ Timeout: {user_settings.get('timeout', DEFAULT_CALL_SETTINGS['timeout'])} seconds\n"
-        
-        keyboard = [
-            [InlineKeyboardButton("👤 Set Username", callback_data="settings_username")],
-            [InlineKeyboardButton("📱 Set Phone", callback_data="settings_phone")],
-            [InlineKeyboardButton("🗣 Set Language", callback_data="settings_language")],
-            [InlineKeyboardButton("🔁 Set Repeat", callback_data="settings_repeat")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        settings_text = (
+            "⚙️ **Your Settings:**\n\n"
+            f"👤 Username: {user_settings.get('username', 'Not set')}\n"
+            f"📱 Phone: {user_settings.get('phone', 'Not set')}\n"
+            f"🗣 Language: {user_settings.get('language', DEFAULT_CALL_SETTINGS['language'])}\n"
+            f"🔁 Repeat: {user_settings.get('repeat', DEFAULT_CALL_SETTINGS['repeat'])} times\n"
+            f"⏱ Timeout: {user_settings.get('timeout', DEFAULT_CALL_SETTINGS['timeout'])} seconds\n"
+        )
         
         await update.message.reply_text(
             settings_text,
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=SETTINGS_KEYBOARD
         )
     
+    @serialized_per_user
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline button callbacks"""
         query = update.callback_query
@@ -247,23 +402,14 @@ class CallSchedulerBot:
         user_id = query.from_user.id
         data = query.data
         
-        logger.info(f"Button callback from user {user_id}: {data}")
+        logger.info("Button callback from user %s: %s", user_id, data)
         
         # Route button callbacks to appropriate handlers
-        if data.startswith("schedule_"):
-            await self.handle_schedule_callback(query, context)
-        elif data.startswith("setup_"):
-            await self.handle_setup_callback(query, context)
-        elif data.startswith("delete_"):
-            await self.handle_delete_callback(query, context)
-        elif data.startswith("settings_"):
-            await self.handle_settings_callback(query, context)
-        elif data == "list_calls":
-            await self.list_calls_from_callback(query, context)
-        elif data.startswith("tz_"):  
-            await self.handle_timezone_callback(query, context) 
-        elif data == "test_call":
-            await self.test_call_from_callback(query, context)
+        prefix, sep, _ = data.partition("_")
+        handler = self._callback_routes.get(data) or self._callback_routes.get(prefix + sep)
+        
+        if handler:
+            await handler(query, context)
         else:
             await query.edit_message_text("❌ Unknown action. Please try again.")
     
@@ -275,6 +421,7 @@ class CallSchedulerBot:
         if data == "tz_auto":
             # Use auto-detected timezone
             self.storage.update_user_settings(user_id, {'timezone': SYSTEM_TIMEZONE})
+            self.scheduler.invalidate_user_timezone(user_id)
             await query.edit_message_text(
                 f"✅ **Timezone Updated**\n\n"
                 f"Your timezone is now set to: **{SYSTEM_TIMEZONE}**\n"
@@ -282,11 +429,11 @@ class CallSchedulerBot:
             )
         elif data == "tz_manual":
             # Set user state for manual timezone input
-            self.user_states[user_id] = {
-                'action': 'settings',
-                'field': 'timezone',
-                'step': 'waiting_for_input'
-            }
+            self._set_user_state(context, UserState(
+                action='settings',
+                field='timezone',
+                step='waiting_for_input'
+            ))
             await query.edit_message_text(
                 "🌍 **Manual Timezone Setup**\n\n"
                 "Enter your timezone (e.g., Asia/Singapore, US/Eastern, Europe/London):\n\n"
@@ -295,43 +442,31 @@ class CallSchedulerBot:
     
     async def handle_schedule_callback(self, query, context):
         """Handle schedule-related button callbacks"""
-        user_id = query.from_user.id
-        data = query.data
+        schedule_type = SCHEDULE_TYPE_CALLBACKS.get(query.data)
         
-        if data == "schedule_once":
-            schedule_type = "once"
-        elif data == "schedule_daily":
-            schedule_type = "daily"
-        elif data == "schedule_weekly":
-            schedule_type = "weekly"
-        else:
+        if schedule_type is None:
             await query.edit_message_text("❌ Invalid schedule type.")
             return
         
         # Set user state
-        self.user_states[user_id] = {
-            'action': 'schedule',
-            'type': schedule_type,
-            'step': 'waiting_for_time'
-        }
+        user_state = UserState(
+            action='schedule',
+            type=schedule_type,
+            step='waiting_for_time'
+        )
+        self._set_user_state(context, user_state)
         
         if schedule_type == "weekly":
             # First ask for weekday
-            self.user_states[user_id]['step'] = 'waiting_for_weekday'
-            
-            keyboard = []
-            for day in VALID_WEEKDAYS:
-                keyboard.append([InlineKeyboardButton(day.title(), callback_data=f"weekday_{day}")])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            user_state.step = 'waiting_for_weekday'
             await query.edit_message_text(
                 "📅 **Which day of the week?**",
                 parse_mode='Markdown',
-                reply_markup=reply_markup
+                reply_markup=WEEKDAY_KEYBOARD
             )
         elif schedule_type == "once":
             # For one-time calls, ask for date first
-            self.user_states[user_id]['step'] = 'waiting_for_date'
+            user_state.step = 'waiting_for_date'
             await query.edit_message_text(
                 "📅 **One-time Call Setup**\n\n"
                 "What date should I call you?\n"
@@ -348,51 +483,75 @@ class CallSchedulerBot:
                 parse_mode='Markdown'
             )
     
+    async def handle_weekday_callback(self, query, context):
+        """Handle weekday selection for weekly calls"""
+        weekday = query.data[len("weekday_"):]
+        user_state = self._get_user_state(context)
+        
+        if user_state is None or user_state.step != 'waiting_for_weekday':
+            await query.edit_message_text("❌ This schedule has expired. Use /schedule to start again.")
+            return
+        
+        if weekday not in VALID_WEEKDAY_SET:
+            await query.edit_message_text(ERROR_MESSAGES["invalid_weekday"])
+            return
+        
+        user_state.weekday = weekday
+        user_state.step = 'waiting_for_time'
+        
+        # Confirm the day and ask for the time in a single edit
+        await query.edit_message_text(
+            f"📅 **Weekly Call on {weekday.title()}s**\n\n"
+            "What time should I call you?\n"
+            "Please use 24-hour format (HH:MM)\n\n"
+            "Examples: 09:30, 14:15, 20:00",
+            parse_mode='Markdown'
+        )
+    
+    @serialized_per_user
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages during conversation flows"""
         user_id = update.effective_user.id
         message_text = update.message.text.strip()
         
         # Check if user is in a conversation state
-        if user_id not in self.user_states:
+        user_state = self._get_user_state(context)
+        if user_state is None:
             await update.message.reply_text(
                 "❓ I'm not sure what you want to do. Try using /help or /start to see available commands."
             )
             return
         
-        user_state = self.user_states[user_id]
-        action = user_state.get('action')
-        step = user_state.get('step')
+        action = user_state.action
         
         if action == 'schedule':
-            await self.handle_schedule_message(update, context, message_text, user_state)
+            await self.handle_schedule_message(update, context, user_id, message_text, user_state)
         elif action == 'test_call':
-            await self.handle_test_call_message(update, context, message_text)
+            await self.handle_test_call_message(update, context, user_id, message_text)
         elif action == 'settings':
-            await self.handle_settings_message(update, context, message_text, user_state)
+            await self.handle_settings_message(update, context, user_id, message_text, user_state)
         else:
             await update.message.reply_text("❓ I'm not sure what you want to do. Try /help")
     
     async def handle_schedule_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                                    message_text: str, user_state: Dict[str, Any]):
+                                    user_id: int, message_text: str, user_state: UserState):
         """Handle messages during schedule conversation"""
-        user_id = update.effective_user.id
-        step = user_state.get('step')
+        step = user_state.step
         
         if step == 'waiting_for_date':
             # Validate date format for one-time calls
             try:
-                from datetime import datetime
-                date_obj = datetime.strptime(message_text, "%Y-%m-%d").date()
-                if date_obj <= datetime.now().date():
+                date_obj = date.fromisoformat(message_text)
+                if date_obj <= date.today():
                     await update.message.reply_text("❌ Date must be in the future!")
                     return
             except ValueError:
                 await update.message.reply_text("❌ Invalid date format. Use YYYY-MM-DD (e.g., 2025-06-17)")
                 return
             
-            user_state['date'] = message_text
-            user_state['step'] = 'waiting_for_time'
+            # fromisoformat also accepts other ISO forms (e.g. 20250617), so store it normalized
+            user_state.date = date_obj.isoformat()
+            user_state.step = 'waiting_for_time'
             
             await update.message.reply_text(
                 "⏰ **What time should I call you?**\n\n"
@@ -407,8 +566,8 @@ class CallSchedulerBot:
                 await update.message.reply_text(ERROR_MESSAGES["invalid_time_format"])
                 return
             
-            user_state['time'] = message_text
-            user_state['step'] = 'waiting_for_message'
+            user_state.time = normalize_time_format(message_text)
+            user_state.step = 'waiting_for_message'
             
             await update.message.reply_text(
                 "📝 **What should I say during the call?**\n\n"
@@ -424,40 +583,46 @@ class CallSchedulerBot:
                 await update.message.reply_text(error_msg)
                 return
             
-            user_state['message'] = message_text
+            user_state.message = message_text
             
             # Create the scheduled call
-            call_id = await self.create_scheduled_call(user_id, user_state)
+            call_data = {
+                'type': user_state.type,
+                'time': user_state.time,
+                'message': user_state.message,
+                'weekday': user_state.weekday,
+                'date': user_state.date
+            }
+            call_id = await self.create_scheduled_call(user_id, call_data)
             
             if call_id:
                 # Clear user state
-                del self.user_states[user_id]
+                self._clear_user_state(context)
                 
-                schedule_info = f"{user_state['type'].title()} call"
-                if user_state['type'] == 'weekly':
-                    schedule_info += f" on {user_state.get('weekday', '').title()}s"
-                elif user_state['type'] == 'once':
-                    schedule_info += f" on {user_state.get('date', 'Unknown date')}"
+                schedule_info = f"{user_state.type.title()} call"
+                if user_state.type == 'weekly':
+                    schedule_info += f" on {(user_state.weekday or '').title()}s"
+                elif user_state.type == 'once':
+                    schedule_info += f" on {user_state.date or 'Unknown date'}"
                 
                 # Build details message
                 details_text = f"✅ Call Scheduled Successfully!\n\n"
                 details_text += f"📋 Details:\n"
                 details_text += f"🆔 ID: {call_id}\n"
-                details_text += f"⏰ Time: {user_state['time']}\n"
+                details_text += f"⏰ Time: {user_state.time}\n"
                 details_text += f"🔄 Type: {schedule_info}\n"
-                if user_state['type'] == 'once':
-                    details_text += f"📅 Date: {user_state.get('date', 'Unknown')}\n"
-                details_text += f"📝 Message: {message_text[:50]}{'...' if len(message_text) > 50 else ''}\n\n"
+                if user_state.type == 'once':
+                    details_text += f"📅 Date: {user_state.date or 'Unknown'}\n"
+                details_text += f"📝 Message: {preview_message(message_text)}\n\n"
                 details_text += f"Use /list to view all your calls or /test to test the system."
                 
                 await update.message.reply_text(details_text)
             else:
                 await update.message.reply_text("❌ Failed to schedule call. Please try again.")
     
-    async def handle_test_call_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message_text: str):
+    async def handle_test_call_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                       user_id: int, message_text: str):
         """Handle test call message"""
-        user_id = update.effective_user.id
-        
         # Validate message
         is_valid, error_msg = validate_message(message_text)
         if not is_valid:
@@ -465,7 +630,7 @@ class CallSchedulerBot:
             return
         
         # Clear user state
-        del self.user_states[user_id]
+        self._clear_user_state(context)
         
         # Make test call
         success = await self.make_test_call(user_id, message_text)
@@ -486,39 +651,38 @@ class CallSchedulerBot:
         try:
             call_id = self.storage.add_scheduled_call(user_id, call_data)
             
-            # Add to scheduler
-            self.scheduler.add_call(user_id, call_id, call_data)
+            # Add to scheduler once the handler yields - the confirmation
+            # reply doesn't depend on it (add_call logs its own failures)
+            asyncio.get_running_loop().call_soon(self.scheduler.add_call, user_id, call_id, call_data)
             
-            logger.info(f"Created scheduled call {call_id} for user {user_id}")
+            logger.info("Created scheduled call %s for user %s", call_id, user_id)
             return call_id
             
         except Exception as e:
-            logger.error(f"Failed to create scheduled call: {e}")
+            logger.error("Failed to create scheduled call: %s", e)
             return None
     
     async def make_test_call(self, user_id: int, message: str) -> bool:
         """Make a test call"""
         try:
-            user_settings = self.storage.get_user_settings(user_id)
-            
-            # Determine target (username or phone)
-            target = user_settings.get('username') or user_settings.get('phone')
-            if not target:
+            target = self.storage.get_call_target(user_id)
+            if target is None:
                 return False
             
             # Make call using CallMeBot API
+            user_settings = self.storage.get_user_settings(user_id)
             success = await self.callmebot.make_call(target, message, user_settings)
             
-            logger.info(f"Test call for user {user_id}: {'success' if success else 'failed'}")
+            logger.info("Test call for user %s: %s", user_id, 'success' if success else 'failed')
             return success
             
         except Exception as e:
-            logger.error(f"Test call failed: {e}")
+            logger.error("Test call failed: %s", e)
             return False
     
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
         """Handle errors"""
-        logger.error(f"Exception while handling an update: {context.error}")
+        logger.error("Exception while handling an update: %s", context.error)
         
     async def handle_setup_callback(self, query, context):
         """Handle setup-related button callbacks"""
@@ -541,26 +705,25 @@ class CallSchedulerBot:
 
     async def handle_settings_callback(self, query, context):
         """Handle settings-related button callbacks"""
-        user_id = query.from_user.id
         data = query.data
         
         if data == "settings_username":
-            self.user_states[user_id] = {
-                'action': 'settings',
-                'field': 'username',
-                'step': 'waiting_for_input'
-            }
+            self._set_user_state(context, UserState(
+                action='settings',
+                field='username',
+                step='waiting_for_input'
+            ))
             await query.edit_message_text(
                 "👤 **Set Username**\n\n"
                 "Enter your Telegram username (with @):\n"
                 "Example: @haowernn"
             )
         elif data == "settings_phone":
-            self.user_states[user_id] = {
-                'action': 'settings',
-                'field': 'phone',
-                'step': 'waiting_for_input'
-            }
+            self._set_user_state(context, UserState(
+                action='settings',
+                field='phone',
+                step='waiting_for_input'
+            ))
             await query.edit_message_text(
                 "📱 **Set Phone Number**\n\n"
                 "Enter your phone number with country code:\n"
@@ -581,31 +744,30 @@ class CallSchedulerBot:
         if not user_calls:
             await query.edit_message_text("📭 You have no scheduled calls.")
         else:
-            calls_text = "📋 **Your Scheduled Calls:**\n\n"
+            parts = ["📋 **Your Scheduled Calls:**\n\n"]
             for call_id, call_info in user_calls.items():
                 # Escape special Markdown characters
                 safe_call_id = call_id.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
-                safe_message = call_info['message'][:30].replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
+                safe_message = preview_message(call_info['message'], 30).replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
                 
-                calls_text += f"• {safe_call_id}: {call_info['time']} - {safe_message}...\n"
+                parts.append(f"• {safe_call_id}: {call_info['time']} - {safe_message}\n")
             
-            await query.edit_message_text(calls_text)
+            await query.edit_message_text("".join(parts))
         
     async def test_call_from_callback(self, query, context):
         """Handle test call from callback"""
         user_id = query.from_user.id
-        user_settings = self.storage.get_user_settings(user_id)
         
-        if not user_settings.get('username') and not user_settings.get('phone'):
+        if self.storage.get_call_target(user_id) is None:
             await query.edit_message_text(
                 "❌ Please set your username or phone in /settings first."
             )
             return
         
-        self.user_states[user_id] = {
-            'action': 'test_call',
-            'step': 'waiting_for_message'
-        }
+        self._set_user_state(context, UserState(
+            action='test_call',
+            step='waiting_for_message'
+        ))
         
         await query.edit_message_text(
             "🧪 **Test Call Setup**\n\n"
@@ -618,10 +780,9 @@ class CallSchedulerBot:
         self.storage.update_user_settings(user_id, {'language': 'en-US-Standard-B'})
         await update.message.reply_text("✅ Language updated to en-US-Standard-B")
 
-    async def handle_settings_message(self, update, context, message_text, user_state):
+    async def handle_settings_message(self, update, context, user_id, message_text, user_state):
         """Handle settings input messages"""
-        user_id = update.effective_user.id
-        field = user_state.get('field')
+        field = user_state.field
         
         if field == 'username':
             # Allow clearing username
@@ -650,16 +811,15 @@ class CallSchedulerBot:
         elif field == 'timezone':
             # Validate and set timezone
             try:
-                import pytz
                 # Test if timezone is valid
-                pytz.timezone(message_text)
+                tz = get_timezone(message_text)
                 
                 # Update user settings
                 self.storage.update_user_settings(user_id, {'timezone': message_text})
+                self.scheduler.invalidate_user_timezone(user_id)
                 
                 # Get current time in new timezone for confirmation
                 try:
-                    tz = pytz.timezone(message_text)
                     current_time = datetime.now(tz)
                     time_str = current_time.strftime("%H:%M:%S %Z")
                     
@@ -669,10 +829,11 @@ class CallSchedulerBot:
                         f"🕐 Current time: {time_str}\n\n"
                         f"All scheduled calls will now use this timezone."
                     )
-                except:
+                except Exception as e:
+                    logger.warning("Could not format time in %s: %s", message_text, e)
                     await update.message.reply_text(f"✅ Timezone set to {message_text}")
                     
-            except pytz.exceptions.UnknownTimeZoneError:
+            except (ZoneInfoNotFoundError, ValueError):
                 await update.message.reply_text(
                     f"❌ **Invalid timezone:** {message_text}\n\n"
                     "Please use a valid timezone like:\n"
@@ -689,7 +850,7 @@ class CallSchedulerBot:
                 return
         
         # Clear user state
-        del self.user_states[user_id]
+        self._clear_user_state(context)
         
     async def timezone_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /timezone command"""
@@ -699,40 +860,72 @@ class CallSchedulerBot:
         
         # Get current time in user's timezone
         try:
-            tz = pytz.timezone(current_tz)
+            tz = get_timezone(current_tz)
             current_time = datetime.now(tz)
             time_str = current_time.strftime("%H:%M:%S %Z")
-        except:
+        except Exception as e:
+            logger.warning("Invalid stored timezone %s for user %s: %s", current_tz, user_id, e)
             time_str = "Unknown"
         
-        timezone_text = f"🌍 **Your Timezone Settings:**\n\n"
-        timezone_text += f"📍 Current: {current_tz}\n"
-        timezone_text += f"🕐 Local time: {time_str}\n"
-        timezone_text += f"🤖 Detected: {SYSTEM_TIMEZONE}\n\n"
-        timezone_text += f"All scheduled calls use your timezone.\n"
-        timezone_text += f"When you schedule for 09:30, it means 9:30 AM in {current_tz}."
-        
-        keyboard = [
-            [InlineKeyboardButton("🔄 Use Auto-Detected", callback_data="tz_auto")],
-            [InlineKeyboardButton("⚙️ Manual Setup", callback_data="tz_manual")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        timezone_text = TIMEZONE_MESSAGE.format(
+            current_tz=current_tz, time_str=time_str, detected_tz=SYSTEM_TIMEZONE
+        )
         
         await update.message.reply_text(
             timezone_text,
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=TIMEZONE_KEYBOARD
         )
 
+    async def post_init(self, application: Application):
+        """Start the scheduler and idle-state sweep once the bot's event loop is running"""
+        self.scheduler.start()
+        self._state_sweep_task = asyncio.create_task(self._sweep_user_states())
+    
+    async def post_stop(self, application: Application):
+        """Stop the scheduler and close API connections while the bot's event loop is still running"""
+        if self._health_server is not None:
+            self._health_server.close()
+            await self._health_server.wait_closed()
+        if self._state_sweep_task is not None:
+            self._state_sweep_task.cancel()
+        await self.scheduler.stop()
+        await self.callmebot.close()
+    
+    async def _handle_health_check(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer GET /health with 200 OK and anything else with 404"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1] == b'/health':
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n'
+                             b'Content-Length: 2\r\nConnection: close\r\n\r\nOK')
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n'
+                             b'Connection: close\r\n\r\n')
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
     def run(self):
         """Run the bot"""
         logger.info("Starting bot...")
         
-        # Start scheduler
-        self.scheduler.start()
-        
-        # Run bot
+        # run_polling runs on the current event loop; set one up here so the
+        # health check answers before the Application initializes (which
+        # needs Telegram to be reachable)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if self.health_port is not None:
+            self._health_server = loop.run_until_complete(asyncio.start_server(
+                self._handle_health_check, '0.0.0.0', self.health_port
+            ))
+            logger.info("Health check server listening on port %s", self.health_port)
+        
+        # Run bot (the scheduler is started from post_init and stopped from post_stop)
         self.application.run_polling(allowed_updates=Update.ALL_TYPES)
         
-        # Stop scheduler when bot stops
-        self.scheduler.stop()
\ No newline at end of file
+        # Write out any deferred storage changes
+        self.storage.flush()
\ No newline at end of file
@@ -7,20 +7,38 @@ Monitors scheduled calls and triggers them at the appropriate times.
 """
 
 import asyncio
+import heapq
+import itertools
 import logging
-import threading
+import random
 import time
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-import schedule
-import pytz
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import date, datetime, time as dtime, timedelta, tzinfo
+from typing import Dict, Any, List, Optional, Set, Tuple
 
 from config import *
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+@dataclass(slots=True)
+class JobRecord:
+    """Scheduler-side state of a call that has a pending run
+    
+    Holds only what rescheduling needs - the call itself stays in storage.
+    """
+    type: str
+    weekday: Optional[str]  # lowercased, weekly calls only
+    user_timezone: str
+    hour: int  # call time, parsed once when the job is built
+    minute: int
+    next_run: float = 0.0
+    seq: int = -1  # Sequence number of the job's live heap entry
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary"""
+        return asdict(self)
+
 class CallScheduler:
     """Manages background scheduling and execution of calls"""
     
@@ -35,132 +53,215 @@ class CallScheduler:
         self.storage = storage_manager
         self.callmebot = callmebot_api
         
-        # Threading control
-        self._scheduler_thread = None
+        # Scheduler loop, run as a task on the bot's event loop
+        self._task: Optional[asyncio.Task] = None
         self._running = False
-        self._stop_event = threading.Event()
         
         # Track scheduled jobs
-        self._scheduled_jobs = {}
+        self._scheduled_jobs: Dict[str, JobRecord] = {}
+        
+        # Timezone per user, kept until invalidate_user_timezone()
+        self._user_timezones: Dict[int, Any] = {}
         
-        # Event loop for async operations
-        self._loop = None
-        self._executor = ThreadPoolExecutor(max_workers=2)
+        # Min-heap of (next_run, seq, call_id), next_run being a UTC epoch.
+        # Entries are never removed in place - one whose seq no longer
+        # matches its job in _scheduled_jobs is stale and skipped when popped,
+        # or dropped by _compact_heap once too many have piled up.
+        self._heap: List[Tuple[float, int, str]] = []
+        self._heap_seq = itertools.count()
+        
+        # Wakes the scheduler loop when the earliest run changes or on stop
+        self._wakeup = asyncio.Event()
+        
+        # Calls in progress, referenced so their tasks aren't garbage collected
+        self._call_tasks: Set[asyncio.Task] = set()
         
         logger.info("CallScheduler initialized")
         
-    def _get_user_timezone(self, user_id: int) -> pytz.timezone:
+    def _get_user_timezone(self, user_id: int) -> tzinfo:
         """Get user's timezone"""
-        try:
-            user_settings = self.storage.get_user_settings(user_id)
-            tz_name = user_settings.get('timezone', DEFAULT_USER_TIMEZONE)
-            return pytz.timezone(tz_name)
-        except:
-            return pytz.timezone(DEFAULT_USER_TIMEZONE)
+        user_tz = self._user_timezones.get(user_id)
+        if user_tz is None:
+            try:
+                user_settings = self.storage.get_user_settings(user_id)
+                user_tz = get_timezone(user_settings.get('timezone', DEFAULT_USER_TIMEZONE))
+            except Exception as e:
+                logger.debug("Using default timezone for user %s: %s", user_id, e)
+                user_tz = get_timezone(DEFAULT_USER_TIMEZONE)
+            self._user_timezones[user_id] = user_tz
+        return user_tz
+    
+    def invalidate_user_timezone(self, user_id: int):
+        """Drop a user's cached timezone and reschedule their calls in the new one"""
+        old_tz = self._user_timezones.pop(user_id, None)
+        
+        # get_timezone() hands out one object per zone, so an unchanged zone is the same object
+        if old_tz is not None and self._get_user_timezone(user_id) is old_tz:
+            return
+        
+        for call_id in self.storage.get_user_calls(user_id):
+            call = self.storage.get_scheduled_call(call_id)
+            if call and call.active:
+                self._schedule_call_job(call_id, call)
 
+    def _next_run_time(self, job: JobRecord, user_tz, after: float) -> float:
+        """
+        Get the next time a recurring job should run, strictly after the given time
+        
+        Args:
+            after: UTC epoch timestamp
+            
+        Returns:
+            float: UTC epoch timestamp
+        """
+        local_now = datetime.fromtimestamp(after, user_tz)
+        
+        if job.type == "daily":
+            days_ahead, period = 0, 1
+        elif job.type == "weekly":
+            days_ahead = (WEEKDAY_INDEX[job.weekday] - local_now.weekday()) % 7
+            period = 7
+        else:
+            raise ValueError(f"Unknown call type: {job.type}")
+        
+        # Aware datetime arithmetic is wall-clock time, so the UTC offset is
+        # looked up for the run date itself and DST changes are handled
+        run_at = local_now.replace(hour=job.hour, minute=job.minute, second=0, microsecond=0)
+        run_ts = (run_at + timedelta(days=days_ahead)).timestamp()
+        if run_ts <= after:
+            run_ts = (run_at + timedelta(days=days_ahead + period)).timestamp()
+        
+        return run_ts
+    
+    def _prepare_call_job(self, call_id: str, call) -> Optional[JobRecord]:
+        """Validate a call and build its job record, or None if it shouldn't be scheduled"""
+        call_type = call.type
+        user_tz = self._get_user_timezone(call.user_id)
+        weekday = call.weekday.lower() if call.weekday else None
+        
+        if call_type == "weekly" and weekday not in WEEKDAY_INDEX:
+            logger.error("Invalid weekday for call %s: %s", call_id, call.weekday)
+            return None
+        if call_type == "once" and not call.date:
+            logger.error("One-time call %s missing date", call_id)
+            return None
+        
+        hour, minute = map(int, call.time.split(":"))
+        job = JobRecord(call_type, weekday, str(user_tz), hour, minute)
+        now = time.time()
+        
+        if call_type == "once":
+            # One-time calls have a fixed run time, so compare epochs directly
+            run_at = datetime.combine(date.fromisoformat(call.date), dtime(hour, minute), user_tz)
+            job.next_run = run_at.timestamp()
+            if job.next_run <= now:
+                # Time has passed, mark as inactive
+                self.storage.update_scheduled_call(call_id, {"active": False})
+                logger.info("One-time call %s time has passed, marked inactive", call_id)
+                return None
+        else:
+            job.next_run = self._next_run_time(job, user_tz, now)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Scheduled %s call %s for %s (%s)", call_type, call_id,
+                         datetime.fromtimestamp(job.next_run, user_tz).strftime("%Y-%m-%d %H:%M"), user_tz)
+        
+        return job
+    
     def _schedule_call_job(self, call_id: str, call):
         """Schedule a single call job with timezone awareness"""
         try:
-            call_time = call.time
-            call_type = call.type
-            user_tz = self._get_user_timezone(call.user_id)
+            job = self._prepare_call_job(call_id, call)
+            if job is None:
+                return
             
-            # Create job function that properly handles async
-            def job():
-                try:
-                    logger.info(f"Executing scheduled job for call {call_id}")
-                    # Run the async call execution in the event loop
-                    if self._loop and not self._loop.is_closed():
-                        future = asyncio.run_coroutine_threadsafe(
-                            self._execute_call(call_id), self._loop
-                        )
-                        # Wait for completion with timeout
-                        future.result(timeout=CALL_EXECUTION_TIMEOUT)
-                    else:
-                        logger.error(f"No event loop available for call {call_id}")
-                except Exception as e:
-                    logger.error(f"Error in job execution for call {call_id}: {e}")
+            # Track the job and queue its next run
+            job.seq = next(self._heap_seq)
+            self._scheduled_jobs[call_id] = job
+            heapq.heappush(self._heap, (job.next_run, job.seq, call_id))
+            if self._heap[0][2] == call_id:
+                self._wakeup.set()
+            self._compact_heap()
             
-            # Schedule based on call type with timezone awareness
-            if call_type == "daily":
-                schedule.every().day.at(call_time).do(job).tag(call_id)
-                logger.info(f"Scheduled daily call {call_id} at {call_time} ({user_tz})")
-                
-            elif call_type == "weekly":
-                weekday = call.weekday.lower()
-                if weekday in VALID_WEEKDAYS:
-                    getattr(schedule.every(), weekday).at(call_time).do(job).tag(call_id)
-                    logger.info(f"Scheduled weekly call {call_id} on {weekday} at {call_time} ({user_tz})")
-                else:
-                    logger.error(f"Invalid weekday for call {call_id}: {weekday}")
-                    return
-                    
-            elif call_type == "once":
-                if call.date:
-                    # Parse date and time in user's timezone
-                    call_datetime_str = f"{call.date} {call_time}"
-                    call_datetime = datetime.strptime(call_datetime_str, f"{DATE_FORMAT} {TIME_FORMAT}")
-                    
-                    # Localize to user's timezone
-                    call_datetime = user_tz.localize(call_datetime)
-                    now_user_tz = datetime.now(user_tz)
-                    
-                    if call_datetime > now_user_tz:
-                        # For one-time calls, we need a different approach
-                        # Schedule it to run daily but check the date in the job
-                        def one_time_job():
-                            try:
-                                # Check if today is the scheduled date
-                                today = datetime.now(user_tz).date()
-                                scheduled_date = datetime.strptime(call.date, DATE_FORMAT).date()
-                                
-                                if today == scheduled_date:
-                                    logger.info(f"Executing one-time call {call_id} for {call.date}")
-                                    # Execute the call
-                                    if self._loop and not self._loop.is_closed():
-                                        future = asyncio.run_coroutine_threadsafe(
-                                            self._execute_call(call_id), self._loop
-                                        )
-                                        future.result(timeout=CALL_EXECUTION_TIMEOUT)
-                                    
-                                    # Mark as inactive after execution
-                                    self.storage.update_scheduled_call(call_id, {"active": False})
-                                    # Remove from scheduler
-                                    schedule.clear(call_id)
-                                    if call_id in self._scheduled_jobs:
-                                        del self._scheduled_jobs[call_id]
-                                elif today > scheduled_date:
-                                    # Date has passed, mark as inactive
-                                    logger.info(f"One-time call {call_id} date has passed")
-                                    self.storage.update_scheduled_call(call_id, {"active": False})
-                                    schedule.clear(call_id)
-                                    if call_id in self._scheduled_jobs:
-                                        del self._scheduled_jobs[call_id]
-                            except Exception as e:
-                                logger.error(f"Error in one-time job for call {call_id}: {e}")
-                        
-                        schedule.every().day.at(call_time).do(one_time_job).tag(call_id)
-                        logger.info(f"Scheduled one-time call {call_id} for {call.date} at {call_time} ({user_tz})")
-                    else:
-                        # Time has passed, mark as inactive
-                        self.storage.update_scheduled_call(call_id, {"active": False})
-                        logger.info(f"One-time call {call_id} time has passed, marked inactive")
-                        return
-                else:
-                    logger.error(f"One-time call {call_id} missing date")
-                    return
+        except Exception as e:
+            logger.error("Error scheduling call %s: %s", call_id, e)
+    
+    def _reschedule_job(self, call_id: str):
+        """Queue the next run of a recurring job from its existing record"""
+        try:
+            job = self._scheduled_jobs.get(call_id)
+            if job is None:
+                return
             
-            # Track the job
-            self._scheduled_jobs[call_id] = {
-                "type": call_type,
-                "time": call_time,
-                "weekday": getattr(call, 'weekday', None),
-                "date": getattr(call, 'date', None),
-                "user_timezone": str(user_tz)
-            }
+            # The record is updated in place, its time already parsed. Anchoring
+            # on the run that just came due means a clock stepping back can't
+            # make it come due again, while a late wakeup still skips ahead.
+            after = max(job.next_run, time.time())
+            job.next_run = self._next_run_time(job, get_timezone(job.user_timezone), after)
+            job.seq = next(self._heap_seq)
+            heapq.heappush(self._heap, (job.next_run, job.seq, call_id))
             
         except Exception as e:
-            logger.error(f"Error scheduling call {call_id}: {e}")
+            logger.error("Error rescheduling call %s: %s", call_id, e)
+    
+    def _run_job(self, call_id: str):
+        """Start a due call in its own task and queue its next run"""
+        call = self.storage.get_scheduled_call(call_id)
+        if not call or not call.active:
+            self._remove_call_job(call_id)
+            return
+        
+        # Don't wait for the call to finish - other due jobs shouldn't queue behind it
+        task = asyncio.create_task(self._run_call(call_id, call.type))
+        self._call_tasks.add(task)
+        task.add_done_callback(self._call_tasks.discard)
+        
+        if call.type == "once":
+            self._remove_call_job(call_id)
+        else:
+            self._reschedule_job(call_id)
+    
+    async def _run_call(self, call_id: str, call_type: str):
+        """Execute a scheduled call, deactivating one-time calls afterwards"""
+        await self._execute_call(call_id)
+        
+        # One-time calls run once, whether or not the call went through
+        if call_type == "once":
+            call = self.storage.get_scheduled_call(call_id)
+            if call and call.active:
+                self.storage.update_scheduled_call(call_id, {"active": False})
+    
+    def _run_due_jobs(self):
+        """Run every job whose next run time has been reached"""
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, call_id = heapq.heappop(self._heap)
+            
+            # Entries of removed or rescheduled jobs are skipped here
+            job = self._scheduled_jobs.get(call_id)
+            if job is None or job.seq != seq:
+                continue
+            
+            self._run_job(call_id)
+    
+    def _compact_heap(self):
+        """Drop stale entries once they outnumber live ones"""
+        # Every scheduled job has exactly one live entry, the rest are stale
+        if len(self._heap) <= 2 * len(self._scheduled_jobs):
+            return
+        
+        jobs = self._scheduled_jobs
+        self._heap[:] = [entry for entry in self._heap
+                         if entry[2] in jobs and jobs[entry[2]].seq == entry[1]]
+        heapq.heapify(self._heap)
+    
+    def _seconds_until_next_job(self) -> Optional[float]:
+        """Time to sleep before checking for due jobs, or None if nothing is scheduled"""
+        if not self._heap:
+            return None
+        # Run times are wall clock epochs but the sleep is timed on the monotonic
+        # clock, so wake at least every SCHEDULER_MAX_SLEEP to catch clock changes
+        return min(max(0.0, self._heap[0][0] - time.time()), SCHEDULER_MAX_SLEEP)
     
     def set_callmebot_api(self, callmebot_api):
         """Set the CallMeBot API instance (used for dependency injection)"""
@@ -168,72 +269,61 @@ class CallScheduler:
         logger.info("CallMeBot API instance set in scheduler")
     
     def start(self):
-        """Start the background scheduler"""
+        """Start the background scheduler (call from the bot's running event loop)"""
         if self._running:
             logger.warning("Scheduler is already running")
             return
         
         logger.info("Starting call scheduler...")
         self._running = True
-        self._stop_event.clear()
         
         # Load existing scheduled calls
         self._load_scheduled_calls()
         
-        # Start scheduler thread
-        self._scheduler_thread = threading.Thread(target=self._scheduler_loop, daemon=True)
-        self._scheduler_thread.start()
+        # Start scheduler loop
+        self._task = asyncio.create_task(self._scheduler_loop())
         
         logger.info("Call scheduler started successfully")
     
-    def stop(self):
+    async def stop(self):
         """Stop the background scheduler"""
         if not self._running:
             return
         
         logger.info("Stopping call scheduler...")
-        self._running = False
-        self._stop_event.set()
         
-        # Clear all scheduled jobs
-        schedule.clear()
+        # Clear all scheduled jobs and wake the loop so it exits
+        self._running = False
+        self._heap.clear()
         self._scheduled_jobs.clear()
+        self._wakeup.set()
         
-        # Wait for thread to finish
-        if self._scheduler_thread and self._scheduler_thread.is_alive():
-            self._scheduler_thread.join(timeout=5)
-        
-        # Shutdown executor
-        self._executor.shutdown(wait=False)
+        # Wait for the loop to finish
+        if self._task:
+            await self._task
         
         logger.info("Call scheduler stopped")
     
-    def _scheduler_loop(self):
-        """Main scheduler loop that runs in background thread"""
+    async def _scheduler_loop(self):
+        """Main scheduler loop that runs as a task on the bot's event loop"""
         logger.info("Scheduler loop started")
         
-        # Create event loop for this thread
-        self._loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self._loop)
-        
-        while self._running and not self._stop_event.is_set():
+        while self._running:
             try:
                 # Run pending scheduled jobs
-                schedule.run_pending()
+                self._run_due_jobs()
                 
-                # Check for any missed calls (in case bot was down)
-                self._check_missed_calls()
-                
-                # Sleep for the configured interval
-                time.sleep(SCHEDULER_CHECK_INTERVAL)
+                # Sleep until the next job is due, a job is added
+                # ahead of it, or the scheduler is stopped
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next_job())
+                except asyncio.TimeoutError:
+                    pass
                 
             except Exception as e:
-                logger.error(f"Error in scheduler loop: {e}")
-                time.sleep(5)  # Wait before retrying
-        
-        # Close the event loop
-        if self._loop:
-            self._loop.close()
+                logger.error("Error in scheduler loop: %s", e)
+                await asyncio.sleep(5)  # Wait before retrying
         
         logger.info("Scheduler loop ended")
     
@@ -245,101 +335,116 @@ class CallScheduler:
         
         try:
             active_calls = self.storage.get_all_active_calls()
-            logger.info(f"Loading {len(active_calls)} active calls")
+            logger.info("Loading %s active calls", len(active_calls))
             
+            # Build every job first, then heapify once rather than pushing one at a time
+            jobs = {}
             for call_id, call in active_calls.items():
-                self._schedule_call_job(call_id, call)
+                try:
+                    record = self._prepare_call_job(call_id, call)
+                except Exception as e:
+                    logger.error("Error scheduling call %s: %s", call_id, e)
+                    continue
+                if record is not None:
+                    jobs[call_id] = record
+            
+            for call_id, job in jobs.items():
+                job.seq = next(self._heap_seq)
+                self._scheduled_jobs[call_id] = job
+                self._heap.append((job.next_run, job.seq, call_id))
+            heapq.heapify(self._heap)
+            self._wakeup.set()
             
-            logger.info(f"Loaded {len(self._scheduled_jobs)} scheduled jobs")
+            logger.info("Loaded %s scheduled jobs", len(self._scheduled_jobs))
             
         except Exception as e:
-            logger.error(f"Error loading scheduled calls: {e}")
+            logger.error("Error loading scheduled calls: %s", e)
     
     async def _execute_call(self, call_id: str):
         """Execute a scheduled call"""
         try:
-            logger.info(f"Executing scheduled call {call_id}")
+            logger.info("Executing scheduled call %s", call_id)
             
             # Get call details from storage
             call = self.storage.get_scheduled_call(call_id)
             if not call:
-                logger.error(f"Call {call_id} not found in storage")
+                logger.error("Call %s not found in storage", call_id)
                 return
             
             if not call.active:
-                logger.info(f"Call {call_id} is inactive, skipping")
+                logger.info("Call %s is inactive, skipping", call_id)
                 return
             
-            # Get user settings
+            # Get user settings and target (username or phone) once for all attempts
             user_settings = self.storage.get_user_settings(call.user_id)
-            
-            # Determine target (username or phone)
-            target = user_settings.get('username') or user_settings.get('phone')
+            target = self.storage.get_call_target(call.user_id)
             if not target:
-                logger.error(f"No username or phone configured for user {call.user_id}")
+                logger.error("No username or phone configured for user %s", call.user_id)
                 return
             
             # Make the call
             if self.callmebot:
-                logger.info(f"Making call to {target[:10]}... with message: {call.message[:30]}...")
-                success = await self.callmebot.make_call(target, call.message, user_settings)
+                success = await self._make_call(call_id, call, target, user_settings)
                 
                 if success:
-                    logger.info(f"Call {call_id} executed successfully")
+                    logger.info("Call %s executed successfully", call_id)
                     # Mark call as executed
                     self.storage.mark_call_executed(call_id)
                     
                     # For one-time calls, the job itself handles deactivation
                     
                 else:
-                    logger.error(f"Call {call_id} execution failed")
+                    logger.error("Call %s execution failed", call_id)
                     
                     # Retry logic
                     if RETRY_FAILED_CALLS:
-                        await self._retry_call(call_id, call)
+                        await self._retry_call(call_id, call, target, user_settings)
             else:
                 logger.error("CallMeBot API not available - check if it's properly set")
                 
         except Exception as e:
-            logger.error(f"Error executing call {call_id}: {e}")
+            logger.error("Error executing call %s: %s", call_id, e)
     
-    async def _retry_call(self, call_id: str, call, retry_count: int = 1):
-        """Retry a failed call"""
-        if retry_count > MAX_CALL_RETRIES:
-            logger.error(f"Call {call_id} failed after {MAX_CALL_RETRIES} retries")
-            return
-        
-        logger.info(f"Retrying call {call_id} (attempt {retry_count})")
-        
-        # Wait before retry
-        await asyncio.sleep(30 * retry_count)  # Exponential backoff
-        
+    async def _make_call(self, call_id: str, call, target: str, user_settings: Dict[str, Any]) -> bool:
+        """Make one call attempt, treating one that takes too long as failed"""
         try:
-            user_settings = self.storage.get_user_settings(call.user_id)
-            target = user_settings.get('username') or user_settings.get('phone')
+            return await asyncio.wait_for(
+                self.callmebot.make_call(target, call.message, user_settings),
+                timeout=CALL_EXECUTION_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.error("Call %s timed out after %s seconds", call_id, CALL_EXECUTION_TIMEOUT)
+            return False
+    
+    async def _retry_call(self, call_id: str, call, target: str, user_settings: Dict[str, Any]):
+        """Retry a failed call with exponential backoff"""
+        deadline = time.monotonic() + RETRY_BUDGET_SECONDS
+        
+        for attempt in range(1, MAX_CALL_RETRIES + 1):
+            # Wait before retry, jittered so calls that failed together don't retry together
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+            delay += random.uniform(0, delay / 2)
+            if time.monotonic() + delay > deadline:
+                logger.error("Call %s retry budget of %s seconds used up", call_id, RETRY_BUDGET_SECONDS)
+                return
+            await asyncio.sleep(delay)
+            
+            logger.info("Retrying call %s (attempt %s)", call_id, attempt)
             
-            if target and self.callmebot:
-                success = await self.callmebot.make_call(target, call.message, user_settings)
+            try:
+                if not self.callmebot:
+                    return
                 
-                if success:
-                    logger.info(f"Call {call_id} retry successful")
+                if await self._make_call(call_id, call, target, user_settings):
+                    logger.info("Call %s retry successful", call_id)
                     self.storage.mark_call_executed(call_id)
-                else:
-                    # Try again
-                    await self._retry_call(call_id, call, retry_count + 1)
-            
-        except Exception as e:
-            logger.error(f"Error retrying call {call_id}: {e}")
-    
-    def _check_missed_calls(self):
-        """Check for calls that might have been missed while bot was down"""
-        try:
-            # This is a simple implementation - could be enhanced
-            # to track and execute missed calls
-            pass
-            
-        except Exception as e:
-            logger.error(f"Error checking missed calls: {e}")
+                    return
+                
+            except Exception as e:
+                logger.error("Error retrying call %s: %s", call_id, e)
+                return
+        
+        logger.error("Call %s failed after %s retries", call_id, MAX_CALL_RETRIES)
     
     def add_call(self, user_id: int, call_id: str, call_data: Dict[str, Any]):
         """Add a new call to the scheduler"""
@@ -348,73 +453,69 @@ class CallScheduler:
             call = self.storage.get_scheduled_call(call_id)
             if call:
                 self._schedule_call_job(call_id, call)
-                logger.info(f"Added call {call_id} to scheduler")
+                logger.info("Added call %s to scheduler", call_id)
             else:
-                logger.error(f"Call {call_id} not found in storage")
+                logger.error("Call %s not found in storage", call_id)
                 
         except Exception as e:
-            logger.error(f"Error adding call {call_id} to scheduler: {e}")
+            logger.error("Error adding call %s to scheduler: %s", call_id, e)
     
     def remove_call(self, call_id: str):
         """Remove a call from the scheduler"""
         try:
             self._remove_call_job(call_id)
-            logger.info(f"Removed call {call_id} from scheduler")
+            logger.info("Removed call %s from scheduler", call_id)
             
         except Exception as e:
-            logger.error(f"Error removing call {call_id} from scheduler: {e}")
+            logger.error("Error removing call %s from scheduler: %s", call_id, e)
     
     def _remove_call_job(self, call_id: str):
         """Remove a specific call job from schedule"""
         try:
-            # Remove from schedule
-            schedule.clear(call_id)
-            
-            # Remove from tracking
-            if call_id in self._scheduled_jobs:
-                del self._scheduled_jobs[call_id]
+            # Remove from tracking - its heap entry is skipped once it comes due
+            self._scheduled_jobs.pop(call_id, None)
+            self._compact_heap()
                 
         except Exception as e:
-            logger.error(f"Error removing call job {call_id}: {e}")
+            logger.error("Error removing call job %s: %s", call_id, e)
     
     def update_call(self, call_id: str, call_data: Dict[str, Any]):
         """Update an existing scheduled call"""
         try:
-            # Remove old job
-            self._remove_call_job(call_id)
-            
-            # Add updated job
+            # Rescheduling replaces the job in one step, so the call is
+            # never missing from the scheduler between removal and re-adding
             call = self.storage.get_scheduled_call(call_id)
             if call and call.active:
                 self._schedule_call_job(call_id, call)
-                logger.info(f"Updated call {call_id} in scheduler")
+                logger.info("Updated call %s in scheduler", call_id)
+            else:
+                self._remove_call_job(call_id)
             
         except Exception as e:
-            logger.error(f"Error updating call {call_id} in scheduler: {e}")
+            logger.error("Error updating call %s in scheduler: %s", call_id, e)
     
     def get_stats(self) -> Dict[str, Any]:
         """Get scheduler statistics"""
         return {
             "running": self._running,
             "scheduled_jobs": len(self._scheduled_jobs),
-            "schedule_jobs": len(schedule.jobs),
+            "pending_runs": len(self._heap),
             "jobs_by_type": self._get_jobs_by_type(),
             "callmebot_available": self.callmebot is not None,
             "storage_available": self.storage is not None,
-            "loop_running": self._loop is not None and not self._loop.is_closed() if self._loop else False
+            "loop_running": self._task is not None and not self._task.done()
         }
     
     def _get_jobs_by_type(self) -> Dict[str, int]:
         """Get count of jobs by type"""
         job_counts = {"daily": 0, "weekly": 0, "once": 0}
         
-        for job_info in self._scheduled_jobs.values():
-            job_type = job_info.get("type", "unknown")
-            if job_type in job_counts:
-                job_counts[job_type] += 1
+        for job in self._scheduled_jobs.values():
+            if job.type in job_counts:
+                job_counts[job.type] += 1
         
         return job_counts
     
     def list_scheduled_jobs(self) -> Dict[str, Any]:
         """List all currently scheduled jobs"""
-        return dict(self._scheduled_jobs)
\ No newline at end of file
+        return {call_id: job.to_dict() for call_id, job in self._scheduled_jobs.items()}
\ No newline at end of file
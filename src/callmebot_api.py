@@ -8,10 +8,10 @@ Makes actual voice calls through Telegram using CallMeBot service.
 
 import asyncio
 import logging
+import re
 import urllib.parse
-from typing import Dict, Any, Optional, Tuple
-import requests
-from datetime import datetime
+from typing import Dict, Any, Mapping, Optional, Tuple
+import httpx
 
 from config import *
 
@@ -21,20 +21,46 @@ logger = logging.getLogger(__name__)
 class CallMeBotAPI:
     """Handles CallMeBot API interactions for making voice calls"""
     
+    # Call query string, filled in with already URL-encoded values
+    CALL_QUERY_TEMPLATE = "source=web&user={user}&text={text}&lang={lang}&rpt={rpt}&cc={cc}&timeout={timeout}"
+    
+    # Valid targets (ASCII only), and bare usernames that need an @ added
+    USERNAME_PATTERN = re.compile(r"@[A-Za-z0-9_]{3,32}")
+    PHONE_PATTERN = re.compile(r"\+[0-9]{7,15}")
+    BARE_USERNAME_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+    
     def __init__(self):
         """Initialize the CallMeBot API client"""
         self.api_url = CALLMEBOT_API_URL
-        self.session = requests.Session()
         
-        # Set reasonable timeout and headers
-        self.session.timeout = 30
-        self.session.headers.update({
-            'User-Agent': f'{BOT_NAME}/{BOT_VERSION}',
-            'Accept': 'application/json, text/plain, */*'
-        })
+        # Async HTTP client, created on first use so it belongs to the running event loop
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Bounds outbound requests so a burst of due calls is fed through a few
+        # kept-alive connections instead of opening one each
+        self._request_slots = asyncio.Semaphore(MAX_CONCURRENT_API_REQUESTS)
         
         logger.info("CallMeBotAPI initialized")
     
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client, creating it if needed"""
+        if self._client is None or self._client.is_closed:
+            # Set reasonable timeout and headers, and keep idle connections
+            # open between calls so they skip the connection setup
+            self._client = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONCURRENT_API_REQUESTS,
+                    max_keepalive_connections=MAX_CONCURRENT_API_REQUESTS,
+                    keepalive_expiry=75
+                ),
+                headers={
+                    'User-Agent': f'{BOT_NAME}/{BOT_VERSION}',
+                    'Accept': 'application/json, text/plain, */*'
+                }
+            )
+        return self._client
+    
     async def make_call(self, target: str, message: str, user_settings: Dict[str, Any] = None) -> bool:
         """
         Make a voice call using CallMeBot API
@@ -48,27 +74,27 @@ class CallMeBotAPI:
             bool: True if call was initiated successfully
         """
         try:
-            # Prepare call parameters
-            call_params = self._prepare_call_params(target, message, user_settings)
+            # Prepare call URL
+            call_url = self._prepare_call_url(target, message, user_settings)
             
-            logger.info(f"Making call to {target[:10]}... with message: {message[:30]}...")
+            logger.info("Making call to %.10s... with message: %.30s...", target, message)
             
             # Make async HTTP request
-            success, response_data = await self._make_api_request(call_params)
+            success, response_data = await self._make_api_request(call_url)
             
             if success:
-                logger.info(f"Call initiated successfully to {target[:10]}...")
+                logger.info("Call initiated successfully to %.10s...", target)
                 return True
             else:
-                logger.error(f"Call failed to {target[:10]}...: {response_data}")
+                logger.error("Call failed to %.10s...: %s", target, response_data)
                 return False
                 
         except Exception as e:
-            logger.error(f"Error making call: {e}")
+            logger.error("Error making call: %s", e)
             return False
     
-    def _prepare_call_params(self, target: str, message: str, user_settings: Dict[str, Any] = None) -> Dict[str, str]:
-        """Prepare API call parameters"""
+    def _prepare_call_url(self, target: str, message: str, user_settings: Dict[str, Any] = None) -> str:
+        """Build the API call URL, encoding each parameter value once"""
         if user_settings is None:
             user_settings = {}
         
@@ -81,32 +107,27 @@ class CallMeBotAPI:
         # Clean inputs
         clean_target = self._clean_target(target)
         clean_message = self._clean_message(message)
-        encoded_message = urllib.parse.quote(clean_message)
         
         # Text copy setting
         cc = "yes" if send_text_copy else "no"
         
-        # Build parameters with source=web
-        params = {
-            'source': 'web',  # ADD THIS
-            'user': clean_target,
-            'text': encoded_message,
-            'lang': language,  # Now uses en-US-Standard-B
-            'rpt': str(repeat),
-            'cc': cc,
-            'timeout': str(timeout)
-        }
-        
-        return params
+        quote = urllib.parse.quote
+        return f"{self.api_url}?" + self.CALL_QUERY_TEMPLATE.format(
+            user=quote(clean_target, safe=''),
+            text=quote(clean_message, safe=''),
+            lang=quote(language, safe=''),
+            rpt=repeat,
+            cc=cc,
+            timeout=timeout
+        )
     
     def _clean_target(self, target: str) -> str:
         """Clean and validate target username or phone"""
         target = target.strip()
         
         # If it looks like a username, ensure it starts with @
-        if not target.startswith('@') and not target.startswith('+'):
-            if target.isalpha() or '_' in target:
-                target = f"@{target}"
+        if self.BARE_USERNAME_PATTERN.fullmatch(target):
+            target = f"@{target}"
         
         return target
     
@@ -118,27 +139,16 @@ class CallMeBotAPI:
         # Ensure message length is within limits
         if len(message) > MAX_MESSAGE_LENGTH:
             message = message[:MAX_MESSAGE_LENGTH-3] + "..."
-            logger.warning(f"Message truncated to {MAX_MESSAGE_LENGTH} characters")
+            logger.warning("Message truncated to %d characters", MAX_MESSAGE_LENGTH)
         
         return message
     
-    async def _make_api_request(self, params: Dict[str, str]) -> Tuple[bool, str]:
+    async def _make_api_request(self, url: str) -> Tuple[bool, str]:
         """Make async HTTP request to CallMeBot API"""
         try:
-            # BUILD THE FULL URL FOR DEBUGGING (handle encoding)
-            full_url = f"{self.api_url}?" + "&".join([f"{k}={v}" for k, v in params.items()])
-            print(f"DEBUG URL: {full_url}")  # Use print instead of logger
-            
-            # Run the synchronous request in a thread pool
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.session.get(self.api_url, params=params, timeout=30)
-            )
-            
-            # Log response with print
-            print(f"DEBUG Response: {response.status_code}")
-            print(f"DEBUG Text: {response.text}")
+            async with self._request_slots:
+                response = await self._get_client().get(url)
+            logger.debug("CallMeBot response %s: %s", response.status_code, response.text)
             
             # Check response
             if response.status_code == 200:
@@ -148,7 +158,7 @@ class CallMeBotAPI:
                 return False, error_msg
                 
         except Exception as e:
-            print(f"Request error: {str(e)}")
+            logger.error("Request error: %s", e)
             return False, f"Request error: {str(e)}"
     
     async def test_call(self, target: str, test_message: str = None) -> Tuple[bool, str]:
@@ -166,7 +176,7 @@ class CallMeBotAPI:
             test_message = "This is a test call from your Telegram Call Scheduler Bot. If you hear this message, everything is working correctly!"
         
         try:
-            logger.info(f"Making test call to {target[:10]}...")
+            logger.info("Making test call to %.10s...", target)
             
             # Use default settings for test
             test_settings = {
@@ -184,7 +194,7 @@ class CallMeBotAPI:
                 return False, "Test call failed. Please check your CallMeBot authorization and target."
                 
         except Exception as e:
-            logger.error(f"Test call error: {e}")
+            logger.error("Test call error: %s", e)
             return False, f"Test call error: {str(e)}"
     
     def validate_target(self, target: str) -> Tuple[bool, str]:
@@ -202,25 +212,23 @@ class CallMeBotAPI:
         
         target = target.strip()
         
-        # Check if it's a username
+        if self.USERNAME_PATTERN.fullmatch(target) or self.PHONE_PATTERN.fullmatch(target):
+            return True, ""
+        
+        # Invalid - work out why for the error message
         if target.startswith('@'):
             username = target[1:]
             if len(username) < 3:
                 return False, "Username too short (minimum 3 characters)"
             if len(username) > 32:
                 return False, "Username too long (maximum 32 characters)"
-            if not username.replace('_', '').isalnum():
-                return False, "Username can only contain letters, numbers, and underscores"
-            return True, ""
+            return False, "Username can only contain letters, numbers, and underscores"
         
-        # Check if it's a phone number
         elif target.startswith('+'):
             phone = target[1:]
-            if not phone.isdigit():
+            if not (phone.isascii() and phone.isdigit()):
                 return False, "Phone number can only contain digits after +"
-            if len(phone) < 7 or len(phone) > 15:
-                return False, "Phone number must be 7-15 digits"
-            return True, ""
+            return False, "Phone number must be 7-15 digits"
         
         # Try to determine type
         else:
@@ -229,13 +237,13 @@ class CallMeBotAPI:
             else:
                 return False, "Usernames must start with @ (e.g., @username)"
     
-    def get_available_languages(self) -> Dict[str, str]:
-        """Get available languages for text-to-speech"""
-        return AVAILABLE_LANGUAGES.copy()
+    def get_available_languages(self) -> Mapping[str, str]:
+        """Get available languages for text-to-speech (read-only)"""
+        return AVAILABLE_LANGUAGES
     
     def validate_language(self, language: str) -> bool:
         """Check if language code is valid"""
-        return language in AVAILABLE_LANGUAGES.values()
+        return language in AVAILABLE_LANGUAGE_CODES
     
     async def check_api_status(self) -> Tuple[bool, str]:
         """
@@ -252,20 +260,16 @@ class CallMeBotAPI:
                 'lang': 'en'
             }
             
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.session.get(self.api_url, params=test_params, timeout=10)
-            )
+            response = await self._get_client().get(self.api_url, params=test_params, timeout=10)
             
             if response.status_code in [200, 400, 403]:  # API is responding
                 return True, "CallMeBot API is accessible"
             else:
                 return False, f"API returned status {response.status_code}"
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             return False, "API request timeout"
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             return False, "Cannot connect to CallMeBot API"
         except Exception as e:
             return False, f"API check error: {str(e)}"
@@ -276,19 +280,20 @@ class CallMeBotAPI:
         # to track actual usage statistics
         return {
             "api_url": self.api_url,
-            "session_active": True,
+            "session_active": self._client is not None and not self._client.is_closed,
             "default_language": DEFAULT_CALL_SETTINGS['language'],
             "available_languages": len(AVAILABLE_LANGUAGES),
             "max_message_length": MAX_MESSAGE_LENGTH
         }
     
-    def close(self):
+    async def close(self):
         """Close the HTTP session"""
         try:
-            self.session.close()
+            if self._client is not None:
+                await self._client.aclose()
             logger.info("CallMeBot API session closed")
         except Exception as e:
-            logger.error(f"Error closing API session: {e}")
+            logger.error("Error closing API session: %s", e)
 
 # Utility functions for testing and validation
 async def test_callmebot_api():
@@ -319,7 +324,7 @@ async def test_callmebot_api():
     stats = api.get_call_stats()
     print(f"\nAPI Stats: {stats}")
     
-    api.close()
+    await api.close()
     print("Test complete")
 
 if __name__ == "__main__":
@@ -7,8 +7,11 @@ Update the values here to customize the bot behavior.
 """
 
 import os
-import pytz
-from datetime import datetime
+import re
+from types import MappingProxyType
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from tzlocal import get_localzone_name
 from typing import Dict, Any
 
 # =============================================
@@ -16,31 +19,38 @@ from typing import Dict, Any
 # =============================================
 
 # Telegram Bot Token - Get this from @BotFather
-# IMPORTANT: Replace with your actual bot token
+# IMPORTANT: Set it in the BOT_TOKEN environment variable, never in the code
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_TOKEN_PATTERN = re.compile(r"\d+:[A-Za-z0-9_-]{11,}")  # Numeric bot ID, colon, secret
 
 # Bot settings
 BOT_NAME = "Call Scheduler Bot"
 BOT_VERSION = "1.0.0"
 
+# Port for the /health endpoint (Render provides PORT)
+HEALTH_CHECK_PORT = int(os.getenv("PORT", "10000"))
+
 # =============================================
 # CALLMEBOT API CONFIGURATION
 # =============================================
 
 # CallMeBot API endpoint
-CALLMEBOT_API_URL = "http://api.callmebot.com/start.php"
+CALLMEBOT_API_URL = "https://api.callmebot.com/start.php"
+
+# Most CallMeBot requests in flight at once; further calls wait for a free slot
+MAX_CONCURRENT_API_REQUESTS = 4
 
-# Default call settings
-DEFAULT_CALL_SETTINGS = {
+# Default call settings (read-only)
+DEFAULT_CALL_SETTINGS = MappingProxyType({
     "language": "en-US-Standard-B",          # Default language for text-to-speech
     "repeat": 2,                # How many times to repeat the message
     "timeout": 30,              # Call timeout in seconds
     "send_text_copy": True      # Whether to send text message copy
-}
+})
 
 # Available languages for CallMeBot TTS
 # Use the "Voice Name" column from CallMeBot documentation
-AVAILABLE_LANGUAGES = {
+AVAILABLE_LANGUAGES = MappingProxyType({
     "English": "en",
     "Spanish": "es", 
     "French": "fr",
@@ -51,7 +61,8 @@ AVAILABLE_LANGUAGES = {
     "Chinese": "zh",
     "Japanese": "ja",
     "Korean": "ko"
-}
+})
+AVAILABLE_LANGUAGE_CODES = frozenset(AVAILABLE_LANGUAGES.values())  # For membership checks
 
 # =============================================
 # STORAGE CONFIGURATION
@@ -61,19 +72,32 @@ AVAILABLE_LANGUAGES = {
 DATA_DIR = "data"
 SCHEDULED_CALLS_FILE = os.path.join(DATA_DIR, "scheduled_calls.json")
 USER_SETTINGS_FILE = os.path.join(DATA_DIR, "user_settings.json")
+CONVERSATION_STATE_FILE = os.path.join(DATA_DIR, "conversation_state.pickle")
 LOGS_DIR = "logs"
 BOT_LOG_FILE = os.path.join(LOGS_DIR, "bot.log")
 
-# Create directories if they don't exist
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(LOGS_DIR, exist_ok=True)
+# Delay (in seconds) before deferred changes are written to disk
+SAVE_DELAY = 2
+
+# Append-only log of scheduled call changes since the last full save, and the
+# size (in bytes) at which it is folded back into SCHEDULED_CALLS_FILE
+SCHEDULED_CALLS_JOURNAL_FILE = os.path.join(DATA_DIR, "scheduled_calls.journal")
+JOURNAL_COMPACT_SIZE = 1024 * 1024
 
 # =============================================
 # SCHEDULER CONFIGURATION
 # =============================================
 
-# How often to check for scheduled calls (in seconds)
-SCHEDULER_CHECK_INTERVAL = 60
+# Idle time (in seconds) before an unfinished conversation is discarded
+CONVERSATION_STATE_TTL = 900
+
+# How often (in seconds) conversations that went idle past the TTL are purged
+CONVERSATION_STATE_SWEEP_INTERVAL = 300
+
+# Longest the scheduler sleeps before re-checking the wall clock (in seconds).
+# Its sleep is timed on the monotonic clock, which doesn't see wall clock
+# adjustments and, on Linux, stops while the machine is suspended.
+SCHEDULER_MAX_SLEEP = 300
 
 # Maximum number of scheduled calls per user
 MAX_CALLS_PER_USER = 50
@@ -82,6 +106,9 @@ MAX_CALLS_PER_USER = 50
 CALL_EXECUTION_TIMEOUT = 120  # Max time to wait for call completion
 RETRY_FAILED_CALLS = True
 MAX_CALL_RETRIES = 3
+RETRY_BASE_DELAY = 30  # Seconds before the first retry, doubling for each one after
+RETRY_MAX_DELAY = 300  # Cap on the delay before a retry (before jitter)
+RETRY_BUDGET_SECONDS = 900  # No retry is started past this long after the first failure
 
 # =============================================
 # MESSAGE TEMPLATES
@@ -164,6 +191,18 @@ Use /test command here to verify everything is working.
 Need help? Just type your question!
 """
 
+# Timezone settings template
+TIMEZONE_MESSAGE = """
+🌍 **Your Timezone Settings:**
+
+📍 Current: {current_tz}
+🕐 Local time: {time_str}
+🤖 Detected: {detected_tz}
+
+All scheduled calls use your timezone.
+When you schedule for 09:30, it means 9:30 AM in {current_tz}.
+"""
+
 # =============================================
 # VALIDATION SETTINGS
 # =============================================
@@ -174,17 +213,21 @@ MIN_MESSAGE_LENGTH = 5
 
 # Time format validation
 TIME_FORMAT = "%H:%M"  # 24-hour format
+TIME_PATTERN = re.compile(r"([01]?[0-9]|2[0-3]):[0-5]?[0-9]")  # Same inputs TIME_FORMAT parses ("9:30" too)
 DATE_FORMAT = "%Y-%m-%d"
 
 # User input validation
-VALID_SCHEDULE_TYPES = ["once", "daily", "weekly"]
-VALID_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+VALID_SCHEDULE_TYPES = ("once", "daily", "weekly")
+VALID_SCHEDULE_TYPE_SET = frozenset(VALID_SCHEDULE_TYPES)  # For membership checks
+VALID_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+VALID_WEEKDAY_SET = frozenset(VALID_WEEKDAYS)  # For membership checks
+WEEKDAY_INDEX = {day: index for index, day in enumerate(VALID_WEEKDAYS)}  # Matches datetime.weekday()
 
 # =============================================
 # ERROR MESSAGES
 # =============================================
 
-ERROR_MESSAGES = {
+ERROR_MESSAGES = MappingProxyType({
     "bot_token_missing": "❌ Bot token not configured! Check config.py",
     "callmebot_unauthorized": "❌ CallMeBot not authorized. Use /setup first.",
     "invalid_time_format": "❌ Invalid time format. Use HH:MM (24-hour format)",
@@ -195,18 +238,18 @@ ERROR_MESSAGES = {
     "api_error": "❌ API error occurred. Please try again later.",
     "invalid_schedule_type": f"❌ Invalid schedule type. Use: {', '.join(VALID_SCHEDULE_TYPES)}",
     "invalid_weekday": f"❌ Invalid weekday. Use: {', '.join(VALID_WEEKDAYS)}"
-}
+})
 
 # =============================================
 # SUCCESS MESSAGES
 # =============================================
 
-SUCCESS_MESSAGES = {
+SUCCESS_MESSAGES = MappingProxyType({
     "call_scheduled": "✅ Call scheduled successfully!",
     "call_deleted": "✅ Call deleted successfully!",
     "test_call_sent": "✅ Test call initiated! Check your phone.",
     "settings_updated": "✅ Settings updated successfully!"
-}
+})
 
 # =============================================
 # UTILITY FUNCTIONS
@@ -221,89 +264,33 @@ def is_valid_bot_token(token: str) -> bool:
     if not token or token == "YOUR_BOT_TOKEN_HERE":
         return False
     
-    # Basic token format validation (should be like: 123456:ABC-DEF...)
-    parts = token.split(":")
-    if len(parts) != 2:
-        return False
-    
-    try:
-        int(parts[0])  # First part should be numeric
-        return len(parts[1]) > 10  # Second part should be reasonably long
-    except ValueError:
-        return False
+    # Token format: numeric bot ID, colon, reasonably long secret (123456:ABC-DEF...)
+    return BOT_TOKEN_PATTERN.fullmatch(token) is not None
 
 def validate_time_format(time_str: str) -> bool:
     """Validate time format (HH:MM)"""
-    try:
-        from datetime import datetime
-        datetime.strptime(time_str, TIME_FORMAT)
-        return True
-    except ValueError:
-        return False
+    return TIME_PATTERN.fullmatch(time_str) is not None
+
+def normalize_time_format(time_str: str) -> str:
+    """Zero-pad a validated time string to HH:MM ("9:30" -> "09:30")"""
+    hour, minute = time_str.split(":")
+    return f"{int(hour):02d}:{int(minute):02d}"
+    
+@lru_cache(maxsize=512)
+def get_timezone(tz_name: str):
+    """Get a ZoneInfo timezone object, memoized by name
     
+    Raises zoneinfo.ZoneInfoNotFoundError for unknown names and ValueError
+    for malformed ones (failed lookups are not cached).
+    """
+    return ZoneInfo(tz_name)
+
+@lru_cache(maxsize=1)
 def get_system_timezone():
-    """Automatically detect system timezone"""
+    """Automatically detect system timezone, detected once per process"""
     try:
-        import time
-        import pytz
-        
-        # Get system timezone
-        if hasattr(time, 'tzname'):
-            # Windows/Unix method
-            local_tz_name = time.tzname[time.daylight]
-            if local_tz_name:
-                return local_tz_name
-        
-        # Alternative method - try to get from system
-        try:
-            import subprocess
-            import platform
-            
-            if platform.system() == "Windows":
-                # Windows timezone detection
-                result = subprocess.run(['tzutil', '/g'], capture_output=True, text=True)
-                if result.returncode == 0:
-                    win_tz = result.stdout.strip()
-                    # Convert Windows timezone to pytz timezone
-                    tz_mapping = {
-                        'Eastern Standard Time': 'US/Eastern',
-                        'Central Standard Time': 'US/Central',
-                        'Mountain Standard Time': 'US/Mountain',
-                        'Pacific Standard Time': 'US/Pacific',
-                        'Singapore Standard Time': 'Asia/Singapore',
-                        # Add more mappings as needed
-                    }
-                    return tz_mapping.get(win_tz, 'UTC')
-            else:
-                # Unix/Linux timezone detection
-                try:
-                    with open('/etc/timezone', 'r') as f:
-                        return f.read().strip()
-                except FileNotFoundError:
-                    pass
-        except:
-            pass
-        
-        # Fallback - detect from current time offset
-        now = datetime.now()
-        utc_now = datetime.utcnow()
-        offset = now - utc_now
-        offset_hours = offset.total_seconds() / 3600
-        
-        # Map common offsets to timezones
-        offset_mapping = {
-            8: 'Asia/Singapore',
-            -5: 'US/Eastern',
-            -6: 'US/Central', 
-            -7: 'US/Mountain',
-            -8: 'US/Pacific',
-            0: 'UTC',
-            1: 'Europe/London',
-            9: 'Asia/Tokyo'
-        }
-        
-        return offset_mapping.get(int(offset_hours), 'UTC')
-        
+        # IANA name from the registry, /etc/localtime or TZ, whichever applies
+        return get_localzone_name() or 'UTC'
     except Exception:
         return 'UTC'  # Safe fallback
 
@@ -311,7 +298,12 @@ def get_system_timezone():
 SYSTEM_TIMEZONE = get_system_timezone()
 DEFAULT_USER_TIMEZONE = SYSTEM_TIMEZONE
 
-print(f"🌍 Detected timezone: {SYSTEM_TIMEZONE}")
+@lru_cache(maxsize=1)
+def initialize_config():
+    """Create data directories and report the detected timezone (runs once)"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    print(f"🌍 Detected timezone: {SYSTEM_TIMEZONE}")
 
 def validate_message(message: str) -> tuple[bool, str]:
     """
@@ -339,7 +331,9 @@ DEBUG_MODE = os.getenv("DEBUG", "False").lower() == "true"
 LOGGING_CONFIG = {
     "level": "DEBUG" if DEBUG_MODE else "INFO",
     "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    "datefmt": "%Y-%m-%d %H:%M:%S"
+    "datefmt": "%Y-%m-%d %H:%M:%S",
+    "max_bytes": 10 * 1024 * 1024,  # Log file size before it is rotated
+    "backup_count": 3               # Rotated log files to keep
 }
 
 # Test settings (for development)
@@ -9,55 +9,46 @@ Chat with this bot to schedule automatic calls using CallMeBot API.
 Usage: python main.py
 """
 
-import asyncio
+import atexit
 import logging
+import logging.handlers
 import os
-from telegram.ext import Application
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import threading
+import queue
 
 import sys
-import os
 
 # Add src directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__)))
 
-from bot_handlers import CallSchedulerBot
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_LOG_FILE, HEALTH_CHECK_PORT, LOGGING_CONFIG, initialize_config
+
+# Create the data and log directories before anything writes to them
+initialize_config()
 
 # Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+# Handlers run on a listener thread so log I/O never blocks the event loop
+log_formatter = logging.Formatter(LOGGING_CONFIG["format"], LOGGING_CONFIG["datefmt"])
+log_handlers = [
+    logging.handlers.RotatingFileHandler(
+        BOT_LOG_FILE,
+        maxBytes=LOGGING_CONFIG["max_bytes"],
+        backupCount=LOGGING_CONFIG["backup_count"]
+    ),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
 
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    """Simple health check handler for Render"""
-    def do_GET(self):
-        if self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'OK')
-        else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def log_message(self, format, *args):
-        # Suppress default HTTP server logs
-        return
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(LOGGING_CONFIG["level"])
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
-def start_health_server():
-    """Start health check server for Render"""
-    port = int(os.environ.get('PORT', 10000))
-    server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-    logger.info(f"Health check server starting on port {port}")
-    server.serve_forever()
+logger = logging.getLogger(__name__)
 
 def main():
     """Main function to start the bot"""
@@ -79,12 +70,11 @@ def main():
     print("=" * 50)
     
     try:
-        # Start health check server in background thread for Render
-        health_thread = threading.Thread(target=start_health_server, daemon=True)
-        health_thread.start()
+        # Imported here so the config checks above don't load the telegram stack
+        from bot_handlers import CallSchedulerBot
         
-        # Create and start the bot
-        bot = CallSchedulerBot(BOT_TOKEN)
+        # Create and start the bot (it also serves the health check for Render)
+        bot = CallSchedulerBot(BOT_TOKEN, health_port=HEALTH_CHECK_PORT)
         
         print("✅ Bot initialized successfully")
         print("📱 You can now chat with your bot on Telegram")
@@ -102,7 +92,7 @@ def main():
         print("\n💡 Troubleshooting:")
         print("1. Check your bot token in Render environment variables")
         print("2. Ensure you have internet connection")
-        print("3. Check the logs in bot.log for details")
+        print(f"3. Check the logs in {BOT_LOG_FILE} for details")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,23 +6,25 @@ This file handles all data persistence for the bot.
 Manages scheduled calls, user settings, and data validation.
 """
 
-import pytz
-import json
+import itertools
+import mmap
+import orjson
 import os
 import logging
+import shutil
 import threading
+from datetime import datetime, time, timedelta, tzinfo
+from typing import Dict, Any, Optional, List, Callable, Tuple
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass, asdict
-from datetime import datetime
-import uuid
+from zoneinfo import ZoneInfoNotFoundError
 
 from config import *
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(slots=True)
 class ScheduledCall:
     """Data class for scheduled call information"""
     call_id: str
@@ -39,14 +41,14 @@ class ScheduledCall:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
-        return asdict(self)
+        return {name: getattr(self, name) for name in self.__slots__}
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'ScheduledCall':
         """Create instance from dictionary"""
         return cls(**data)
 
-@dataclass
+@dataclass(slots=True)
 class UserSettings:
     """Data class for user settings"""
     user_id: int
@@ -61,47 +63,43 @@ class UserSettings:
     updated_at: Optional[str] = None
     
     # Add timezone utility functions
-    def get_user_timezone(user_settings: Dict[str, Any]) -> pytz.timezone:
+    def get_user_timezone(user_settings: Dict[str, Any]) -> tzinfo:
         """Get user's timezone object"""
         tz_name = user_settings.get('timezone', DEFAULT_USER_TIMEZONE)
         try:
-            return pytz.timezone(tz_name)
-        except:
-            return pytz.timezone('UTC')
+            return get_timezone(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            return get_timezone('UTC')
 
     def now_in_timezone(timezone_name: str) -> datetime:
         """Get current time in specified timezone"""
         try:
-            tz = pytz.timezone(timezone_name)
-            return datetime.now(tz)
-        except:
+            tz = get_timezone(timezone_name)
+        except (ZoneInfoNotFoundError, ValueError):
             return datetime.now()
+        return datetime.now(tz)
 
     def convert_time_to_user_tz(time_str: str, user_timezone: str) -> datetime:
         """Convert HH:MM time string to datetime in user's timezone"""
+        if not validate_time_format(time_str):
+            raise ValueError(f"Invalid time format: {time_str!r}")
+        hour, minute = time_str.split(":")
+        time_obj = time(int(hour), int(minute))
+        
+        # Get user timezone
         try:
-            from datetime import time
-            time_obj = datetime.strptime(time_str, "%H:%M").time()
-            
-            # Get user timezone
-            tz = pytz.timezone(user_timezone)
-            
-            # Create datetime for today in user's timezone
-            today = datetime.now(tz).date()
-            dt = datetime.combine(today, time_obj)
-            
-            # Localize to user's timezone
-            return tz.localize(dt)
-            
-        except Exception as e:
+            tz = get_timezone(user_timezone)
+        except (ZoneInfoNotFoundError, ValueError):
             # Fallback to local time
-            time_obj = datetime.strptime(time_str, "%H:%M").time()
-            today = datetime.now().date()
-            return datetime.combine(today, time_obj)
+            return datetime.combine(datetime.now().date(), time_obj)
+        
+        # Create datetime for today in user's timezone
+        today = datetime.now(tz).date()
+        return datetime.combine(today, time_obj, tzinfo=tz)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
-        return asdict(self)
+        return {name: getattr(self, name) for name in self.__slots__}
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'UserSettings':
@@ -114,15 +112,37 @@ class StorageManager:
     def __init__(self):
         """Initialize the storage manager"""
         self.scheduled_calls_file = SCHEDULED_CALLS_FILE
+        self.calls_journal_file = SCHEDULED_CALLS_JOURNAL_FILE
         self.user_settings_file = USER_SETTINGS_FILE
         
-        # Thread lock for file operations
-        self._lock = threading.Lock()
+        # Thread locks for file operations, one per data file so saving one
+        # never waits on the other, plus one for the deferred save timers
+        self._calls_lock = threading.Lock()
+        self._settings_lock = threading.Lock()
+        self._timers_lock = threading.Lock()
         
         # In-memory cache
         self._scheduled_calls: Dict[str, ScheduledCall] = {}
         self._user_settings: Dict[int, UserSettings] = {}
         
+        # Call IDs per user, in creation order (values are unused)
+        self._calls_by_user: Dict[int, Dict[str, None]] = {}
+        
+        # Scheduled call journal, opened for appending on first change
+        self._calls_journal = None
+        self._calls_journal_size = 0
+        
+        # Dict form of user settings, rebuilt only after a change
+        self._user_settings_dicts: Dict[int, Dict[str, Any]] = {}
+        
+        # Pending deferred saves, keyed by save method name (see _schedule_save)
+        self._save_timers: Dict[str, Tuple[threading.Timer, Callable[[], None]]] = {}
+        
+        # Call ID parts: a random per-process nonce and a counter seeded from
+        # the start time, so IDs stay unique across restarts
+        self._call_id_nonce = os.urandom(4).hex()
+        self._call_id_counter = itertools.count(int(datetime.now().timestamp()))
+        
         # Load existing data
         self.load_all_data()
         
@@ -141,30 +161,62 @@ class StorageManager:
         """Load scheduled calls from file"""
         try:
             if os.path.exists(self.scheduled_calls_file):
-                with open(self.scheduled_calls_file, 'r') as f:
-                    data = json.load(f)
+                data = self._read_file(self.scheduled_calls_file)
                 
                 # Convert to ScheduledCall objects
                 for call_data in data.values():
-                    call = ScheduledCall.from_dict(call_data)
-                    self._scheduled_calls[call.call_id] = call
-                
-                logger.info(f"Loaded {len(self._scheduled_calls)} scheduled calls")
+                    self._store_call(ScheduledCall.from_dict(call_data))
             else:
                 logger.info("No existing scheduled calls file found")
+            
+            # Apply the changes made since the file was last saved
+            self._replay_calls_journal()
+            
+            logger.info(f"Loaded {len(self._scheduled_calls)} scheduled calls")
                 
         except Exception as e:
             logger.error(f"Error loading scheduled calls: {e}")
             self._scheduled_calls = {}
+            self._calls_by_user = {}
+    
+    def _replay_calls_journal(self):
+        """Apply the scheduled call journal on top of the loaded calls"""
+        if not os.path.exists(self.calls_journal_file):
+            return
+        
+        valid_size = 0
+        with open(self.calls_journal_file, 'r+b') as f:
+            for line in f:
+                record = None
+                if line.endswith(b"\n"):
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        pass
+                
+                if record is None:
+                    # A line cut short by a crash mid-append ends the journal;
+                    # drop it so new entries don't get appended onto it
+                    logger.warning("Dropping incomplete scheduled call journal entry")
+                    f.truncate(valid_size)
+                    break
+                
+                if record["op"] == "upsert":
+                    self._store_call(ScheduledCall.from_dict(record["call"]))
+                else:
+                    self._discard_call(record["call_id"])
+                valid_size += len(line)
+        
+        self._calls_journal_size = valid_size
     
     def load_user_settings(self):
         """Load user settings from file"""
         try:
             if os.path.exists(self.user_settings_file):
-                with open(self.user_settings_file, 'r') as f:
-                    data = json.load(f)
+                data = self._read_file(self.user_settings_file)
                 
                 # Convert to UserSettings objects
+                self._user_settings_dicts.clear()
                 for user_id_str, settings_data in data.items():
                     user_id = int(user_id_str)
                     settings = UserSettings.from_dict(settings_data)
@@ -181,39 +233,147 @@ class StorageManager:
     def save_scheduled_calls(self):
         """Save scheduled calls to file"""
         try:
-            with self._lock:
-                # Convert to serializable format
-                data = {}
-                for call_id, call in self._scheduled_calls.items():
-                    data[call_id] = call.to_dict()
+            with self._calls_lock:
+                # orjson serializes the dataclasses natively, no dict copies needed
+                self._write_file(self.scheduled_calls_file, self._scheduled_calls)
                 
-                # Write to file
-                with open(self.scheduled_calls_file, 'w') as f:
-                    json.dump(data, f, indent=2)
+                # Everything in the journal is in the file now
+                if self._calls_journal is not None:
+                    self._calls_journal.truncate(0)
+                elif os.path.exists(self.calls_journal_file):
+                    os.truncate(self.calls_journal_file, 0)
+                self._calls_journal_size = 0
                 
-                logger.debug(f"Saved {len(data)} scheduled calls to file")
+                logger.debug(f"Saved {len(self._scheduled_calls)} scheduled calls to file")
                 
-        except Exception as e:
+        except (OSError, orjson.JSONEncodeError) as e:
             logger.error(f"Error saving scheduled calls: {e}")
     
     def save_user_settings(self):
         """Save user settings to file"""
         try:
-            with self._lock:
-                # Convert to serializable format
-                data = {}
-                for user_id, settings in self._user_settings.items():
-                    data[str(user_id)] = settings.to_dict()
+            with self._settings_lock:
+                # orjson serializes the dataclasses natively, no dict copies needed
+                self._write_file(self.user_settings_file, self._user_settings)
                 
-                # Write to file
-                with open(self.user_settings_file, 'w') as f:
-                    json.dump(data, f, indent=2)
+                logger.debug(f"Saved settings for {len(self._user_settings)} users to file")
                 
-                logger.debug(f"Saved settings for {len(data)} users to file")
-                
-        except Exception as e:
+        except (OSError, orjson.JSONEncodeError) as e:
             logger.error(f"Error saving user settings: {e}")
     
+    def _journal_call(self, call_id: str):
+        """
+        Record a change to one scheduled call
+        
+        Appends the call's current state (or its deletion) to the journal
+        instead of rewriting the whole file; the journal is folded into the
+        file by a full save once it grows past JOURNAL_COMPACT_SIZE.
+        """
+        call = self._scheduled_calls.get(call_id)
+        if call is not None:
+            record = {"op": "upsert", "call": call}
+        else:
+            record = {"op": "delete", "call_id": call_id}
+        line = orjson.dumps(record) + b"\n"
+        
+        try:
+            with self._calls_lock:
+                if self._calls_journal is None:
+                    self._calls_journal = open(self.calls_journal_file, 'ab', buffering=0)
+                self._calls_journal.write(line)
+                self._calls_journal_size += len(line)
+                journal_size = self._calls_journal_size
+        except OSError as e:
+            # Fall back to a full save so the change isn't lost
+            logger.error(f"Error writing scheduled call journal: {e}")
+            journal_size = JOURNAL_COMPACT_SIZE
+        
+        if journal_size >= JOURNAL_COMPACT_SIZE:
+            self._schedule_save(self.save_scheduled_calls)
+    
+    def _read_file(self, path: str) -> Dict[str, Any]:
+        """
+        Read and parse a data file
+        
+        The file is memory-mapped and parsed in place rather than first
+        being copied into a bytes object.
+        """
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    return orjson.loads(view)
+    
+    def _write_file(self, path: str, data: Dict[str, Any]):
+        """
+        Atomically replace a data file
+        
+        The data is written to a temporary file that is then renamed over
+        the original, so a crash mid-write never leaves a truncated file.
+        It is not fsynced here - see sync().
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            # Integer user IDs are written as string keys
+            f.write(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp_path, path)
+    
+    def sync(self):
+        """
+        Force the data files and their renames to disk
+        
+        Regular saves skip fsync since it is slow; this is called on
+        shutdown and before backups instead.
+        """
+        try:
+            with self._calls_lock, self._settings_lock:
+                paths = [self.scheduled_calls_file, self.calls_journal_file, self.user_settings_file]
+                paths += {os.path.dirname(path) or '.' for path in paths}
+                for path in paths:
+                    if os.path.exists(path):
+                        fd = os.open(path, os.O_RDONLY)
+                        try:
+                            os.fsync(fd)
+                        finally:
+                            os.close(fd)
+        except OSError as e:
+            logger.error(f"Error syncing data files: {e}")
+    
+    def _schedule_save(self, save: Callable[[], None]):
+        """
+        Run a save method after SAVE_DELAY seconds
+        
+        Changes are applied in memory right away; only the file write is
+        deferred, so a burst of changes results in a single save.
+        """
+        with self._timers_lock:
+            if save.__name__ not in self._save_timers:
+                timer = threading.Timer(SAVE_DELAY, self._run_scheduled_save, args=(save,))
+                timer.daemon = True
+                self._save_timers[save.__name__] = (timer, save)
+                timer.start()
+    
+    def _run_scheduled_save(self, save: Callable[[], None]):
+        """Run a deferred save"""
+        with self._timers_lock:
+            self._save_timers.pop(save.__name__, None)
+        save()
+    
+    def flush(self):
+        """Write any pending deferred changes to disk immediately and sync them"""
+        with self._timers_lock:
+            pending = list(self._save_timers.values())
+            self._save_timers.clear()
+        
+        for timer, save in pending:
+            timer.cancel()
+            save()
+        
+        # Fold any journaled call changes into the calls file
+        if self._calls_journal_size:
+            self.save_scheduled_calls()
+        
+        self.sync()
+    
     def add_scheduled_call(self, user_id: int, call_data: Dict[str, Any]) -> str:
         """
         Add a new scheduled call
@@ -242,10 +402,10 @@ class StorageManager:
             )
             
             # Add to memory cache
-            self._scheduled_calls[call_id] = call
+            self._store_call(call)
             
             # Save to file
-            self.save_scheduled_calls()
+            self._journal_call(call_id)
             
             logger.info(f"Added scheduled call {call_id} for user {user_id}")
             return call_id
@@ -254,6 +414,20 @@ class StorageManager:
             logger.error(f"Error adding scheduled call: {e}")
             raise
     
+    def _store_call(self, call: ScheduledCall):
+        """Add or replace a call in the memory cache and the per-user index"""
+        self._scheduled_calls[call.call_id] = call
+        self._calls_by_user.setdefault(call.user_id, {})[call.call_id] = None
+    
+    def _discard_call(self, call_id: str):
+        """Remove a call from the memory cache and the per-user index"""
+        call = self._scheduled_calls.pop(call_id, None)
+        if call is not None:
+            user_call_ids = self._calls_by_user[call.user_id]
+            del user_call_ids[call_id]
+            if not user_call_ids:
+                del self._calls_by_user[call.user_id]
+    
     def get_scheduled_call(self, call_id: str) -> Optional[ScheduledCall]:
         """Get a specific scheduled call by ID"""
         return self._scheduled_calls.get(call_id)
@@ -265,12 +439,10 @@ class StorageManager:
         Returns:
             Dict with call_id as key and call data as value
         """
-        user_calls = {}
-        for call_id, call in self._scheduled_calls.items():
-            if call.user_id == user_id:
-                user_calls[call_id] = call.to_dict()
-        
-        return user_calls
+        return {
+            call_id: self._scheduled_calls[call_id].to_dict()
+            for call_id in self._calls_by_user.get(user_id, ())
+        }
     
     def get_all_active_calls(self) -> Dict[str, ScheduledCall]:
         """Get all active scheduled calls"""
@@ -302,7 +474,7 @@ class StorageManager:
                     setattr(call, field, value)
             
             # Save changes
-            self.save_scheduled_calls()
+            self._journal_call(call_id)
             
             logger.info(f"Updated scheduled call {call_id}")
             return True
@@ -323,8 +495,8 @@ class StorageManager:
         """
         try:
             if call_id in self._scheduled_calls:
-                del self._scheduled_calls[call_id]
-                self.save_scheduled_calls()
+                self._discard_call(call_id)
+                self._journal_call(call_id)
                 logger.info(f"Deleted scheduled call {call_id}")
                 return True
             return False
@@ -343,7 +515,7 @@ class StorageManager:
         if call_id in self._scheduled_calls:
             call = self._scheduled_calls[call_id]
             call.active = not call.active
-            self.save_scheduled_calls()
+            self._journal_call(call_id)
             logger.info(f"Toggled call {call_id} active status to {call.active}")
             return call.active
         return False
@@ -359,7 +531,7 @@ class StorageManager:
             if call.type == 'once':
                 call.active = False
             
-            self.save_scheduled_calls()
+            self._journal_call(call_id)
             logger.info(f"Marked call {call_id} as executed (count: {call.execution_count})")
     
     def initialize_user(self, user_id: int) -> UserSettings:
@@ -370,17 +542,32 @@ class StorageManager:
                 created_at=datetime.now().isoformat()
             )
             self._user_settings[user_id] = settings
-            self.save_user_settings()
+            self._schedule_save(self.save_user_settings)
             logger.info(f"Initialized new user {user_id}")
         
         return self._user_settings[user_id]
     
     def get_user_settings(self, user_id: int) -> Dict[str, Any]:
-        """Get user settings as dictionary"""
-        if user_id not in self._user_settings:
-            self.initialize_user(user_id)
+        """
+        Get user settings as dictionary
+        
+        The returned dict is cached until the settings change,
+        so callers must treat it as read-only.
+        """
+        settings_dict = self._user_settings_dicts.get(user_id)
+        if settings_dict is None:
+            if user_id not in self._user_settings:
+                self.initialize_user(user_id)
+            
+            settings_dict = self._user_settings[user_id].to_dict()
+            self._user_settings_dicts[user_id] = settings_dict
         
-        return self._user_settings[user_id].to_dict()
+        return settings_dict
+    
+    def get_call_target(self, user_id: int) -> Optional[str]:
+        """Get the username or phone to call for a user, or None if neither is set"""
+        user_settings = self.get_user_settings(user_id)
+        return user_settings.get('username') or user_settings.get('phone') or None
     
     def update_user_settings(self, user_id: int, updates: Dict[str, Any]) -> bool:
         """
@@ -406,9 +593,10 @@ class StorageManager:
             
             # Update timestamp
             settings.updated_at = datetime.now().isoformat()
+            self._user_settings_dicts.pop(user_id, None)
             
             # Save changes
-            self.save_user_settings()
+            self._schedule_save(self.save_user_settings)
             
             logger.info(f"Updated settings for user {user_id}")
             return True
@@ -419,20 +607,18 @@ class StorageManager:
     
     def generate_call_id(self) -> str:
         """Generate a unique call ID"""
-        # Use timestamp + short UUID for uniqueness
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        short_uuid = str(uuid.uuid4())[:8]
-        return f"call_{timestamp}_{short_uuid}"
+        return f"call_{self._call_id_nonce}_{next(self._call_id_counter):x}"
     
     def get_stats(self) -> Dict[str, Any]:
         """Get storage statistics"""
         total_calls = len(self._scheduled_calls)
-        active_calls = len([call for call in self._scheduled_calls.values() if call.active])
         total_users = len(self._user_settings)
         
-        # Count calls by type
+        # Count active calls and calls by type in a single pass
+        active_calls = 0
         call_types = {}
         for call in self._scheduled_calls.values():
+            active_calls += call.active
             call_types[call.type] = call_types.get(call.type, 0) + 1
         
         return {
@@ -455,23 +641,23 @@ class StorageManager:
             days_old: Remove calls older than this many days
         """
         try:
-            from datetime import timedelta
-            cutoff_date = datetime.now() - timedelta(days=days_old)
+            # last_executed is a naive ISO timestamp, so string order is time order
+            cutoff_iso = (datetime.now() - timedelta(days=days_old)).isoformat()
             
             calls_to_remove = []
             for call_id, call in self._scheduled_calls.items():
                 if (call.type == 'once' and 
                     not call.active and 
                     call.last_executed and
-                    datetime.fromisoformat(call.last_executed) < cutoff_date):
+                    call.last_executed < cutoff_iso):
                     calls_to_remove.append(call_id)
             
             # Remove old calls
             for call_id in calls_to_remove:
-                del self._scheduled_calls[call_id]
+                self._discard_call(call_id)
+                self._journal_call(call_id)
             
             if calls_to_remove:
-                self.save_scheduled_calls()
                 logger.info(f"Cleaned up {len(calls_to_remove)} old calls")
             
             return len(calls_to_remove)
@@ -484,21 +670,18 @@ class StorageManager:
         """Create a backup of all data"""
         try:
             os.makedirs(backup_dir, exist_ok=True)
+            self.flush()
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
             # Backup scheduled calls
             if os.path.exists(self.scheduled_calls_file):
                 backup_file = os.path.join(backup_dir, f"scheduled_calls_{timestamp}.json")
-                with open(self.scheduled_calls_file, 'r') as src:
-                    with open(backup_file, 'w') as dst:
-                        dst.write(src.read())
+                shutil.copyfile(self.scheduled_calls_file, backup_file)
             
             # Backup user settings
             if os.path.exists(self.user_settings_file):
                 backup_file = os.path.join(backup_dir, f"user_settings_{timestamp}.json")
-                with open(self.user_settings_file, 'r') as src:
-                    with open(backup_file, 'w') as dst:
-                        dst.write(src.read())
+                shutil.copyfile(self.user_settings_file, backup_file)
             
             logger.info(f"Data backup created in {backup_dir}")
             return True
@@ -523,7 +706,7 @@ def validate_call_data(call_data: Dict[str, Any]) -> tuple[bool, str]:
             return False, f"Missing required field: {field}"
     
     # Validate schedule type
-    if call_data['type'] not in VALID_SCHEDULE_TYPES:
+    if call_data['type'] not in VALID_SCHEDULE_TYPE_SET:
         return False, ERROR_MESSAGES["invalid_schedule_type"]
     
     # Validate time format
@@ -538,7 +721,7 @@ def validate_call_data(call_data: Dict[str, Any]) -> tuple[bool, str]:
     # Validate weekday for weekly calls
     if call_data['type'] == 'weekly':
         weekday = call_data.get('weekday', '').lower()
-        if weekday not in VALID_WEEKDAYS:
+        if weekday not in VALID_WEEKDAY_SET:
             return False, ERROR_MESSAGES["invalid_weekday"]
     
     return True, ""
@@ -547,6 +730,7 @@ if __name__ == "__main__":
     # Test the storage manager
     print("Testing StorageManager...")
     
+    initialize_config()
     storage = StorageManager()
     stats = storage.get_stats()
     